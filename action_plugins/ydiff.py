@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+'''
+Ansible action plugin for the ydiff module.
+
+When the task runs on the controller itself (local connection), the ydiff module
+is imported and run in-process instead of being packaged, copied and started as
+a new interpreter for every task. For any other connection, asynchronous tasks
+(or if this Ansible version cannot validate module arguments on the controller),
+the module is executed as usual.
+'''
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import os
+import sys
+import json
+
+from ansible.module_utils._text import to_text
+from ansible.plugins.action import ActionBase
+
+try:
+    from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+except ImportError:
+    ArgumentSpecValidator = None
+
+# Name under which the ydiff module is imported on the controller
+YDIFF_MODULE_NAME = 'ansible_role_k8s_ydiff'
+
+# Module utils of this role imported by the ydiff module (from <role>/module_utils)
+YDIFF_MODULE_UTILS = ('k8s_exec',)
+
+
+def import_module(name, path):
+    '''
+    Import a Python source file as module (only once per process).
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+    return module
+
+
+class ActionModule(ActionBase):
+    '''
+    Run ydiff in-process on the controller (or as module on remote hosts).
+    '''
+    TRANSFERS_FILES = False
+    _supports_check_mode = True
+    _supports_async = True
+
+    def _run_in_process(self):
+        '''
+        ydiff can run in-process if the task is executed locally and synchronously.
+        '''
+        return (
+            ArgumentSpecValidator is not None and
+            getattr(self._connection, 'transport', None) == 'local' and
+            not self._task.async_val
+        )
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp # tmp no longer has any effect
+
+        if not self._run_in_process():
+            result.update(self._execute_module(
+                module_name='ydiff',
+                module_args=self._task.args,
+                task_vars=task_vars,
+                wrap_async=self._task.async_val
+            ))
+            if not self._task.async_val:
+                # async jobs clean up their tmp path themselves
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+
+        # The module utils of the role are only bundled into packaged modules,
+        # in-process they are imported from the role before the module itself
+        path = self._shared_loader_obj.module_loader.find_plugin('ydiff', mod_type='.py')
+        for name in YDIFF_MODULE_UTILS:
+            import_module(
+                'ansible.module_utils.%s' % (name),
+                os.path.join(os.path.dirname(os.path.dirname(path)), 'module_utils', name + '.py')
+            )
+        ydiff = import_module(YDIFF_MODULE_NAME, path)
+
+        # Pass arguments as plain data (as a module would receive them via JSON),
+        # as libyaml only accepts exact str/bytes and no Ansible (unsafe) subclasses
+        args = json.loads(json.dumps(self._task.args, default=to_text))
+
+        # Validate arguments the same way AnsibleModule does
+        validated = ArgumentSpecValidator(
+            ydiff.ARGUMENT_SPEC,
+            **ydiff.ARGUMENT_CONSTRAINTS
+        ).validate(args)
+        if validated.error_messages:
+            result.update(dict(failed=True, msg=' '.join(validated.error_messages)))
+            return result
+
+        module = ydiff.ModuleProxy(
+            validated.validated_parameters,
+            check_mode=self._play_context.check_mode,
+            diff=self._play_context.diff
+        )
+        try:
+            ydiff.run_module(module)
+        except ydiff.ModuleExit as err:
+            result.update(err.result)
+        return result
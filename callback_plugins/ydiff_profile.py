@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+'''
+Ansible callback plugin to aggregate the ydiff timings of a run.
+
+Collects the 'timings' of every ydiff result (single mode and all batch entries)
+and prints the slowest templates, the totals per phase and the totals per kind
+at the end of the playbook. The ydiff task must be run with 'timings: True'
+(role variable 'k8s_diff_timings').
+'''
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+DOCUMENTATION = '''
+callback: ydiff_profile
+type: aggregate
+short_description: Profile report of the ydiff timings
+description:
+    - Aggregates the C(timings) returned by the ydiff module over all tasks and hosts of a run.
+    - Prints the slowest templates, the totals per phase and the totals per kind.
+requirements:
+    - enable in configuration (C(callbacks_enabled) or C(callback_whitelist))
+options:
+  top:
+    description: Number of slowest templates to show.
+    default: 10
+    type: int
+    env:
+      - name: YDIFF_PROFILE_TOP
+    ini:
+      - section: callback_ydiff_profile
+        key: top
+'''
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    '''
+    Aggregate the ydiff timings and print them at the end of the run.
+    '''
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ydiff_profile'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self.__items = []
+        self.__phases = {}
+        self.__kinds = {}
+        self.__top = 10
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(task_keys=task_keys, var_options=var_options, direct=direct)
+        self.__top = int(self.get_option('top'))
+
+    def __add(self, host, name, timings):
+        '''
+        Add the timings of a single diff.
+        '''
+        if not isinstance(timings, dict):
+            return
+        self.__items.append((timings.get('total', 0.0), host, name, timings))
+        for phase, secs in timings.get('phases', {}).items():
+            self.__phases[phase] = self.__phases.get(phase, 0.0) + secs
+        for kind, secs in timings.get('kinds', {}).items():
+            self.__kinds[kind] = self.__kinds.get(kind, 0.0) + secs
+
+    def v2_runner_on_ok(self, result):
+        res = result._result # pylint: disable=protected-access
+        host = result._host.get_name() # pylint: disable=protected-access
+        if 'timings' in res:
+            self.__add(host, result.task_name, res['timings'])
+        for item in res.get('results', []):
+            if isinstance(item, dict) and 'timings' in item:
+                self.__add(host, item.get('name') or result.task_name, item['timings'])
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.v2_runner_on_ok(result)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.__items:
+            return
+
+        self._display.banner('YDIFF PROFILE')
+        total = sum(item[0] for item in self.__items)
+        self._display.display('%d diff(s) in %.3fs' % (len(self.__items), total))
+
+        self._display.display('\nSlowest templates:')
+        for secs, host, name, timings in sorted(self.__items, key=lambda item: -item[0])[:self.__top]:
+            self._display.display('  %8.3fs  %s: %s (%s / %s bytes)' % (
+                secs, host, name, timings.get('source_bytes', '-'), timings.get('target_bytes', '-')
+            ))
+
+        self._display.display('\nPer phase:')
+        for phase, secs in sorted(self.__phases.items(), key=lambda item: -item[1]):
+            self._display.display('  %8.3fs  %s' % (secs, phase))
+
+        if self.__kinds:
+            self._display.display('\nPer kind:')
+            for kind, secs in sorted(self.__kinds.items(), key=lambda item: -item[1]):
+                self._display.display('  %8.3fs  %s' % (secs, kind))
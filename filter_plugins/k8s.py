@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+'''
+Ansible filter plugins to select and group the template items of this role.
+
+k8s_select replaces the per item tag conditions by a single pass over the
+template list and k8s_group groups the selected items by their effective
+connection (context and auth variables), so that everything derived from the
+connection (e.g.: the kubectl command) is only built once per group.
+'''
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from ansible.errors import AnsibleFilterError
+
+# Connection keys of an item (or the global k8s_<key> variables) and their kubectl option
+CONNECTION_KEYS = (
+    ('context', '--context'),
+    ('api_key', '--token'),
+    ('ssl_ca_cert', '--certificate-authority'),
+    ('cert_file', '--client-certificate'),
+    ('key_file', '--client-key'),
+    ('host', '--server'),
+    ('username', '--username'),
+    ('password', '--password'),
+)
+
+
+def k8s_select(items, tag=None):
+    '''
+    Return the items matching tag (by 'tag' or 'tags') in their given order.
+
+    Args:
+      items (list):  Template items (k8s_templates_create or k8s_templates_remove)
+      tag (str):     k8s_tag or None to select all items
+    Returns:
+      list:          Selected items
+    '''
+    if not isinstance(items, list):
+        raise AnsibleFilterError('k8s_select expects a list, got %s' % (type(items).__name__))
+    if tag is None:
+        return list(items)
+    if not tag:
+        return []
+    return [
+        item for item in items
+        if tag == item.get('tag') or (item.get('tags') and tag in item['tags'])
+    ]
+
+
+def k8s_connection(item, defaults=None):
+    '''
+    Return the effective connection of an item: its own connection keys take
+    precedence over the global defaults, unset (None) keys are left out.
+    An empty context is the same as none (kubectl's current context).
+    '''
+    defaults = defaults or {}
+    connection = {}
+    for key, _ in CONNECTION_KEYS:
+        value = item[key] if key in item else defaults.get(key)
+        if value is None or (key == 'context' and not value):
+            continue
+        connection[key] = value
+    return connection
+
+
+def k8s_kubectl(connection):
+    '''
+    Return the base kubectl command of a connection.
+    '''
+    command = ['kubectl']
+    for key, option in CONNECTION_KEYS:
+        if key in connection:
+            command.append('%s=%s' % (option, quote(str(connection[key]))))
+    return ' '.join(command)
+
+
+def k8s_group(items, defaults=None):
+    '''
+    Group items by their effective connection (in order of first appearance,
+    the order of the items is kept within each group).
+
+    Args:
+      items (list):     Selected template items
+      defaults (dict):  Global connection variables (k8s_context, k8s_api_key, ...)
+    Returns:
+      list:             Groups with 'name' ('[<context>] ' or ''), 'connection',
+                        'kubectl' (base kubectl command) and 'templates' (the items)
+    '''
+    groups = []
+    index = {}
+    for item in items:
+        connection = k8s_connection(item, defaults)
+        key = tuple((name, str(connection.get(name))) for name, _ in CONNECTION_KEYS)
+        if key not in index:
+            index[key] = len(groups)
+            groups.append({
+                'name': ('[%s] ' % (connection['context'])) if 'context' in connection else '',
+                'connection': connection,
+                'kubectl': k8s_kubectl(connection),
+                'templates': [],
+            })
+        groups[index[key]]['templates'].append(item)
+    return groups
+
+
+class FilterModule(object):
+    '''
+    Template selection and grouping filters.
+    '''
+    def filters(self):
+        return {
+            'k8s_select': k8s_select,
+            'k8s_group': k8s_group,
+        }
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# (c) 2017, cytopia <cytopia@everythingcli.org>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+ANSIBLE_METADATA = {'metadata_version': '2.0',
+                    'supported_by': 'community',
+                    'status': ['preview']}
+
+DOCUMENTATION = '''
+---
+module: k8s_remove
+author: cytopia (@cytopia)
+
+short_description: k8s_remove deletes the Kubernetes objects of many templates at once via kubectl.
+description:
+    - Deletes all Kubernetes objects of a list of (multi-document) templates in a single module call.
+    - Which objects exist is checked up front with a single C(kubectl get) list call per kubectl command
+      (context), namespace and kind. Objects which do not exist are skipped without any write.
+    - Existing objects are deleted concurrently on a bounded pool of C(kubectl delete) calls, phase by
+      phase as defined by I(order) (e.g. workloads before ConfigMaps and Namespaces last).
+    - In check mode only the existence is checked and the objects which would be deleted are reported.
+version_added: '2.6'
+options:
+    batch:
+        description:
+            - List of templates whose objects to remove.
+            - Each entry is a dictionary with the keys I(definition) (the yaml of the template, may contain
+              multiple documents), I(command) (the base kubectl command including its connection options,
+              e.g. C(kubectl --context=prod)) and an optional I(name) used as label in the results.
+        required: true
+        aliases: []
+
+    order:
+        description:
+            - Deletion phases as list of lists of kinds. All objects of a phase are deleted (concurrently)
+              before the next phase starts. C(*) stands for all kinds not listed in any phase.
+            - An empty list deletes all objects concurrently.
+        required: false
+        default: [[Deployment, StatefulSet, DaemonSet, ReplicaSet, ReplicationController, Job, CronJob, Pod],
+                  ['*'], [Namespace]]
+        aliases: []
+
+    concurrency:
+        description:
+            - Maximum number of concurrent kubectl calls (list and delete calls).
+        required: false
+        default: 5
+        aliases: []
+
+    wait:
+        description:
+            - Wait for every object to be gone (e.g. finalizers) before its delete call returns.
+        required: false
+        default: False
+        aliases: []
+
+    command_timeout:
+        description:
+            - Timeout in seconds for each kubectl call. Set to C(0) to disable the timeout.
+        required: false
+        default: 0
+        aliases: []
+'''
+
+EXAMPLES = '''
+# Remove the objects of two templates
+- k8s_remove:
+    batch:
+      - name: namespace.yml
+        definition: "{{ lookup('template', 'namespace.yml.j2') }}"
+        command: 'kubectl --context=prod'
+      - name: deployment.yml
+        definition: "{{ lookup('template', 'deployment.yml.j2') }}"
+        command: 'kubectl --context=prod'
+    concurrency: 10
+'''
+
+RETURN = '''
+results:
+    description:
+        - Per-entry results in the same order as I(batch), each containing C(name), C(changed) and C(objects).
+        - Entries with an object which could not be checked or deleted contain C(failed) and C(msg).
+    returned: always
+    type: list
+objects:
+    description:
+        - Per-object results (in the entry results), each containing C(apiVersion), C(kind), C(namespace),
+          C(name) and C(state), which is one of C(deleted), C(absent) (did not exist) or C(failed).
+        - Failed objects contain C(msg) with the error.
+    returned: always
+    type: list
+'''
+
+# pylint: disable=wrong-import-position
+# Python imports for module operation
+import yaml
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = dict
+
+# Use the C-accelerated libyaml loader if PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# Python imports for Ansible
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_native
+from ansible.module_utils.k8s_exec import shell_exec, run_pool, kubectl_resource
+
+# Default deletion phases: workloads first, namespaces last
+DEFAULT_ORDER = [
+    ['Deployment', 'StatefulSet', 'DaemonSet', 'ReplicaSet', 'ReplicationController', 'Job', 'CronJob', 'Pod'],
+    ['*'],
+    ['Namespace'],
+]
+
+
+################################################################################
+# Helper Classes
+################################################################################
+
+class RemoveError(Exception):
+    '''
+    Raised for errors which only fail the objects of a single list or delete call.
+    '''
+
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def load_objects(definition):
+    '''
+    Return the identities (apiVersion, kind, namespace, name) of all objects of a template.
+    '''
+    objects = []
+    try:
+        docs = list(yaml.load_all(definition, Loader=YamlLoader))
+    except yaml.YAMLError as err:
+        raise RemoveError('invalid definition: %s' % (err))
+    for doc in docs:
+        if doc is None:
+            continue
+        if not isinstance(doc, dict) or not isinstance(doc.get('metadata'), dict) or \
+                not doc.get('kind') or not doc['metadata'].get('name'):
+            raise RemoveError('definition contains a document which is no Kubernetes object')
+        objects.append((
+            doc.get('apiVersion'),
+            str(doc['kind']),
+            doc['metadata'].get('namespace'),
+            str(doc['metadata']['name'])
+        ))
+    return objects
+
+
+def phase_of(kind, order):
+    '''
+    Return the deletion phase of a kind.
+    '''
+    other = len(order)
+    for idx, kinds in enumerate(order):
+        if kind in kinds:
+            return idx
+        if '*' in kinds:
+            other = idx
+    return other
+
+
+################################################################################
+# Ansible: Module functions
+################################################################################
+
+def list_existing(groups, concurrency, timeout):
+    '''
+    List the names of all existing objects per group (command, namespace, apiVersion, kind).
+
+    Returns:
+      dict:  (names, error) per group
+    '''
+    def list_group(key):
+        '''List the object names of a group'''
+        command, namespace, api_version, kind = key
+        command = '%s get %s -o name' % (command, quote(kubectl_resource(api_version, kind)))
+        if namespace:
+            command += ' --namespace %s' % (quote(namespace))
+        ret, stdout, stderr = shell_exec(command, timeout)
+        stdout, stderr = to_native(stdout), to_native(stderr)
+        if ret != 0:
+            # Objects of an unknown kind (e.g.: removed custom resource) cannot exist
+            if 'the server doesn\'t have a resource type' in stderr:
+                return set()
+            raise RemoveError('list failed: %s' % (stderr.strip() or 'exit code %d' % ret))
+        return set(line.rpartition('/')[2] for line in stdout.splitlines() if line.strip())
+
+    keys = list(groups)
+    return dict(zip(keys, run_pool(list_group, keys, concurrency)))
+
+
+def delete_object(command, ident, wait, timeout):
+    '''
+    Delete a single object (an object deleted in between is no error).
+    '''
+    api_version, kind, namespace, name = ident
+    command = '%s delete %s %s --ignore-not-found --wait=%s' % (
+        command, quote(kubectl_resource(api_version, kind)), quote(name), 'true' if wait else 'false'
+    )
+    if namespace:
+        command += ' --namespace %s' % (quote(namespace))
+    ret, _, stderr = shell_exec(command, timeout)
+    if ret != 0:
+        raise RemoveError('delete failed: %s' % (to_native(stderr).strip() or 'exit code %d' % ret))
+
+
+def run_module(module):
+    '''
+    Remove the objects of all batch entries and exit the module with the result.
+    '''
+    concurrency = module.params.get('concurrency')
+    timeout = module.params.get('command_timeout')
+    order = module.params.get('order') or []
+
+    # Collect all objects and group them for the existence check
+    entries = []
+    groups = OrderedDict()
+    for idx, entry in enumerate(module.params.get('batch')):
+        if not isinstance(entry, dict) or not entry.get('definition') or not entry.get('command'):
+            module.fail_json(msg='batch entry %d requires a definition and a command' % (idx))
+        result = dict(name=entry.get('name'), changed=False, objects=[])
+        objects = []
+        try:
+            objects = load_objects(entry['definition'])
+        except RemoveError as err:
+            result.update(failed=True, msg=to_native(err))
+        for ident in objects:
+            groups.setdefault((entry['command'], ident[2], ident[0], ident[1]), None)
+            result['objects'].append(dict(
+                zip(('apiVersion', 'kind', 'namespace', 'name'), ident), state='absent'
+            ))
+        entries.append((entry['command'], objects, result))
+
+    # Check which objects exist (absent ones need no write)
+    existing = list_existing(groups, concurrency, timeout)
+    phases = dict()
+    for command, objects, result in entries:
+        for ident, obj in zip(objects, result['objects']):
+            names, error = existing[(command, ident[2], ident[0], ident[1])]
+            if error is not None:
+                obj.update(state='failed', msg=to_native(error))
+            elif ident[3] in names:
+                phases.setdefault(phase_of(ident[1], order), []).append((command, ident, obj))
+
+    # Delete phase by phase, all objects of a phase concurrently
+    for phase in sorted(phases):
+        jobs = phases[phase]
+        if module.check_mode:
+            errors = [None] * len(jobs)
+        else:
+            errors = [error for _, error in run_pool(
+                lambda job: delete_object(job[0], job[1], module.params.get('wait'), timeout),
+                jobs,
+                concurrency
+            )]
+        for (_, _, obj), error in zip(jobs, errors):
+            if error is not None:
+                obj.update(state='failed', msg=to_native(error))
+            else:
+                obj['state'] = 'deleted'
+
+    # Per entry results
+    results = []
+    for _, _, result in entries:
+        result['changed'] = any(obj['state'] == 'deleted' for obj in result['objects'])
+        failed = [obj for obj in result['objects'] if obj['state'] == 'failed']
+        if failed:
+            result.update(failed=True, msg=failed[0]['msg'])
+        results.append(result)
+
+    result = dict(results=results, changed=any(res['changed'] for res in results))
+    failed = [res for res in results if res.get('failed')]
+    if failed:
+        result['msg'] = '%d of %d batch entries failed' % (len(failed), len(results))
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+################################################################################
+# Ansible: Initialize module
+################################################################################
+
+def init_ansible_module():
+    '''
+    Initialize Ansible Module.
+    '''
+    return AnsibleModule(
+        argument_spec=dict(
+            batch=dict(type='list', required=True),
+            order=dict(type='list', required=False, default=DEFAULT_ORDER),
+            concurrency=dict(type='int', required=False, default=5),
+            wait=dict(type='bool', required=False, default=False),
+            command_timeout=dict(type='int', required=False, default=0),
+        ),
+        supports_check_mode=True
+    )
+
+
+################################################################################
+# Main entry point
+################################################################################
+
+def main():
+    '''
+    Main entry point
+    '''
+    # Initialize module
+    module = init_ansible_module()
+    run_module(module)
+
+
+if __name__ == '__main__':
+    main()
@@ -28,20 +28,25 @@ short_description: ydiff compares strings, files or command outputs as normalize
 description:
     - ydiff compares a string, file or command output against a string file or command output.
     - Check mode is only supported when diffing strings or files, commands will only be executed in actual run.
+    - Multiple diffs can be done in a single module call by specifying them as a list via I(batch).
+    - Source and target can contain multiple yaml documents. Kubernetes objects are matched by
+      apiVersion, kind, namespace and name and diffed per object, other documents are matched by position.
     - More examples at U(https://github.com/cytopia/ansible-module-ydiff)
 version_added: '2.6'
 options:
     source:
         description:
             - The source input to diff. Can be a string, contents of a file or output from a command, depending on I(source_type).
-        required: true
+            - Required unless I(batch) is specified.
+        required: false
         default: null
         aliases: []
 
     target:
         description:
             - The target input to diff. Can be a string, contents of a file or output from a command, depending on I(target_type).
-        required: true
+            - Required unless I(batch) is specified.
+        required: false
         default: null
         aliases: []
 
@@ -56,14 +61,31 @@ options:
     target_type:
         description:
             - Specify the input type of I(target).
+            - C(kubectl) treats I(target) as the base kubectl command (including its connection options) and
+              reads out the deployed counterparts of all Kubernetes objects in I(source) by a single call
+              per context, namespace and kind (see I(kubectl_fetch)). In I(batch) mode these calls are shared
+              across all entries. Objects not found are reported as to be created without any extra call.
         required: false
         default: string
-        choices: [string, file, command]
+        choices: [string, file, command, kubectl]
         aliases: []
 
     diff_ignore_keys:
         description:
             - Dictionary of keys to be ignored
+            - Keys with an empty value are always removed, keys with a value are only removed if they have the same value.
+            - Keys can contain shell-style wildcards (C(*), C(?), C([seq])) to match multiple keys, a plain C(*)
+              also matches every element of a list.
+        required: false
+        default: {}
+        aliases: []
+
+    diff_ignore_profiles:
+        description:
+            - Dictionary of I(diff_ignore_keys) per Kubernetes kind, applied to each document according to its kind.
+            - The profile C(_all) is merged into every kind, I(diff_ignore_keys) is merged on top.
+            - Profiles are merged and compiled once per kind and module call, batch entries with equal
+              profiles and ignore keys share them.
         required: false
         default: {}
         aliases: []
@@ -74,6 +96,182 @@ options:
         required: false
         default: False
         aliases: []
+
+    diff_digest_size:
+        description:
+            - Values larger than this many bytes are compared by their SHA-256 digest and shown as
+              C(<sha256:<hex> <size> bytes>) in the diff instead of in full. Changed values show up
+              with differing digests, unchanged ones are identical on both sides.
+            - Set to C(0) to always compare and show values in full.
+        required: false
+        default: 0
+        aliases: []
+
+    diff_digest_secrets:
+        description:
+            - Always compare and show the C(data) and C(stringData) values of Secrets by their digest
+              (regardless of I(diff_digest_size)).
+        required: false
+        default: True
+        aliases: []
+
+    diff_format:
+        description:
+            - Format of the diff output (only returned in diff mode).
+            - C(full) returns the complete normalized documents as C(before) and C(after) and leaves
+              the line diff to Ansible.
+            - C(unified) computes a unified diff in the module and only returns its hunks as C(prepared),
+              plus per-object C(stats) (lines C(added) and C(removed) and number of C(paths) changed).
+        required: false
+        default: full
+        choices: [full, unified]
+        aliases: []
+
+    diff_context:
+        description:
+            - Number of context lines around each change for I(diff_format=unified).
+        required: false
+        default: 3
+        aliases: []
+
+    diff_max_lines:
+        description:
+            - Maximum number of diff lines per object for I(diff_format=unified), the rest is truncated.
+            - Set to C(0) to return all lines.
+        required: false
+        default: 0
+        aliases: []
+
+    batch:
+        description:
+            - List of diffs to process in a single module call (mutually exclusive with I(source) and I(target)).
+            - Each entry is a dictionary with the keys I(source), I(target), I(source_type), I(target_type),
+              I(diff_ignore_keys), I(command_timeout), I(max_document_size) and an optional I(name) used as a label
+              in the diff output.
+            - The optional I(state_key) identifies an entry in I(state_file) (defaults to I(name)).
+            - Keys that are omitted in an entry default to the module-level options.
+        required: false
+        default: null
+        aliases: []
+
+    command_timeout:
+        description:
+            - Timeout in seconds for each command when I(source_type) or I(target_type) is C(command).
+            - The command (including all of its child processes) is killed and the module fails when the timeout is hit.
+            - Set to C(0) to disable the timeout.
+        required: false
+        default: 0
+        aliases: []
+
+    max_document_size:
+        description:
+            - Maximum size in bytes of a single yaml document in the output of a command (I(source_type) or
+              I(target_type) C(command)) or of a kubectl list call (I(target_type=kubectl)).
+            - Command outputs are loaded while they are read from the command. A larger document (note that
+              a Kubernetes List counts as one document) fails the entry before it is completely loaded.
+            - The size is accurate to one read chunk (16 KiB). Set to C(0) to disable the limit.
+        required: false
+        default: 0
+        aliases: []
+
+    concurrency:
+        description:
+            - Maximum number of batch entries whose inputs (e.g.: command outputs) are retrieved concurrently.
+            - Results are returned in the order of I(batch) and a failing entry does not affect the others.
+        required: false
+        default: 1
+        aliases: []
+
+    timings:
+        description:
+            - Return the wall time per phase (C(fetch_source), C(fetch_target), C(parse), C(normalize), C(compare),
+              C(dump) and C(diff)), per kind and the input sizes as C(timings).
+            - The C(ydiff_profile) callback plugin of this role aggregates them over a whole run.
+        required: false
+        default: False
+        aliases: []
+
+    memory_stats:
+        description:
+            - Trace the memory allocated by the whole run (Python 3.4+ only) and return it as C(memory).
+            - Tracing slows down the run considerably, only enable it for profiling.
+        required: false
+        default: False
+        aliases: []
+
+    kubectl_fetch:
+        description:
+            - Only used with I(target_type=kubectl).
+            - C(list) reads out all objects of a kind per namespace with a single list call (best suited for many
+              objects per namespace).
+            - C(name) only reads out the objects in I(source) by their names with a single
+              C(kubectl get <kind> <name>... --ignore-not-found) per context, namespace and kind.
+        required: false
+        default: list
+        choices: [list, name]
+        aliases: []
+
+    kubectl_proxy:
+        description:
+            - Only used with I(target_type=kubectl).
+            - Start one C(kubectl proxy) per distinct kubectl command (context) on a random local port and
+              read out all deployed objects through it as HTTP requests over keep-alive connections,
+              instead of starting a kubectl process for every list call.
+            - Resources are discovered once per API group version. Objects without namespace are read
+              from the default namespace of the context.
+            - The proxies are terminated once all objects are read out.
+        required: false
+        default: False
+        aliases: []
+
+    state_file:
+        description:
+            - Only used in I(batch) mode. JSON file to keep the fingerprints of converged entries (no changes) in.
+            - An entry is keyed by its I(state_key) (defaults to I(name)) and stores the sha256 of its source
+              (including the ignore and digest options) and of its deployed objects. With I(target_type=kubectl)
+              the deployed objects are fingerprinted by their identity and C(resourceVersion), otherwise by the
+              raw target input.
+            - Entries whose fingerprints are unchanged since they converged are not diffed again and returned
+              with C(cached) set. Entries which changed or failed are removed from the state.
+        required: false
+        default: null
+        aliases: []
+
+    state_full:
+        description:
+            - Diff all entries regardless of I(state_file) (the state is still updated).
+        required: false
+        default: False
+        aliases: []
+
+    cache_file:
+        description:
+            - Only used with I(target_type=kubectl). JSON file to cache the normalized deployed objects in
+              across runs (e.g.: a check mode run followed by the real run), keyed by context (kubectl command),
+              apiVersion, kind, namespace and name together with their C(resourceVersion).
+            - Every group of objects is revalidated by a metadata-only read of their C(resourceVersion) first
+              (C(kubectl get -o custom-columns) or C(PartialObjectMetadata) requests with I(kubectl_proxy)).
+              Only objects which changed since they were cached are read out and parsed in full (by their names).
+            - Secrets are never cached. The file is only readable by its owner.
+        required: false
+        default: null
+        aliases: []
+
+    cache_size:
+        description:
+            - Maximum size in bytes of all objects in I(cache_file), the least recently used objects
+              are evicted beyond it (C(0) for unlimited).
+        required: false
+        default: 67108864
+        aliases: []
+
+    cache_flush:
+        description:
+            - Invalidate all cached objects of the contexts (kubectl commands) used by this call before
+              reading out the deployed objects (the cache is refilled by this call).
+        required: false
+        default: False
+        aliases: []
 '''
 
 EXAMPLES = '''
@@ -116,6 +314,68 @@ EXAMPLES = '''
       meta:
         creationTimestamp:
       status:
+
+# Diff compare two normalized yaml files, but ignore all 'kubectl.kubernetes.io/' annotations
+# and the 'imagePullPolicy' of every container if it is set to 'IfNotPresent'
+- ydiff:
+    source: /tmp/file-1.yml
+    target: /tmp/file-2.yml
+    source_type: file
+    target_type: file
+    diff_ignore_keys:
+      metadata:
+        annotations:
+          kubectl.kubernetes.io/*:
+      spec:
+        containers:
+          '*':
+            imagePullPolicy: IfNotPresent
+
+# Diff compare multiple templates against their deployed counterparts in one call
+- ydiff:
+    batch:
+      - name: namespace.yml
+        source: "{{ lookup('template', 'namespace.yml.j2') }}"
+        target: 'kubectl get -f /tmp/namespace.yml -o yaml'
+      - name: deployment.yml
+        source: "{{ lookup('template', 'deployment.yml.j2') }}"
+        target: 'kubectl get -f /tmp/deployment.yml -o yaml'
+    source_type: string
+    target_type: command
+
+# Same as above, but read out all deployed objects with one 'kubectl get' per namespace and kind
+- ydiff:
+    batch:
+      - name: namespace.yml
+        source: "{{ lookup('template', 'namespace.yml.j2') }}"
+        target: 'kubectl --context=prod'
+      - name: deployment.yml
+        source: "{{ lookup('template', 'deployment.yml.j2') }}"
+        target: 'kubectl --context=prod'
+    source_type: string
+    target_type: kubectl
+
+# Same as above, but only read out the objects of the templates by their names
+- ydiff:
+    batch:
+      - name: deployment.yml
+        source: "{{ lookup('template', 'deployment.yml.j2') }}"
+        target: 'kubectl --context=prod'
+    source_type: string
+    target_type: kubectl
+    kubectl_fetch: name
+
+# Same as above, but keep the deployed objects in a cache file and only read out
+# the objects whose resourceVersion changed since the previous run in full
+- ydiff:
+    batch:
+      - name: deployment.yml
+        source: "{{ lookup('template', 'deployment.yml.j2') }}"
+        target: 'kubectl --context=prod'
+    source_type: string
+    target_type: kubectl
+    kubectl_fetch: name
+    cache_file: /var/cache/ydiff/prod.json
 '''
 
 RETURN = '''
@@ -124,46 +384,821 @@ ydiff:
     returned: success
     type: string
     sample: + this line was added
+results:
+    description:
+        - Per-entry results in the same order as I(batch), each containing C(name), C(changed), C(objects)
+          and C(diff) (only in diff mode)
+        - Entries whose input could not be retrieved contain C(failed) and C(msg) instead
+        - Entries known to be unchanged from I(state_file) contain C(cached) and are not diffed
+    returned: success, when I(batch) is specified
+    type: list
+objects:
+    description:
+        - Per-object results, each containing C(changed), C(changes) and (for Kubernetes objects)
+          C(apiVersion), C(kind), C(namespace) and C(name).
+        - C(changes) is a structured list of changes to turn the target into the source, with JSON-Pointer
+          style paths. Only the outermost differing path is listed.
+    returned: success
+    type: list
+    sample: [{"changed": true, "kind": "Deployment", "changes": [{"op": "replace", "path": "/spec/replicas"}]}]
+timings:
+    description:
+        - Wall time in seconds per phase and per kind, their C(total) and the sizes of the source and
+          target input (C(source_bytes), C(target_bytes)), only if I(timings) is set.
+        - In batch mode they are returned per entry in C(results).
+    returned: success, when I(timings) is set
+    type: dict
+    sample: {"phases": {"fetch_target": 0.21, "parse": 0.002}, "kinds": {"Deployment": 0.004}, "total": 0.216}
+memory:
+    description:
+        - Memory allocated by the run, only if I(memory_stats) is set (empty on Python 2).
+        - C(peak_bytes) is the peak of traced memory, C(retained_bytes) the memory still allocated at the end
+          and C(allocated_blocks) the net number of allocated memory blocks.
+    returned: success, when I(memory_stats) is set
+    type: dict
+    sample: {"peak_bytes": 1843200, "retained_bytes": 20480, "allocated_blocks": 312}
+cache_stats:
+    description:
+        - Number of deployed objects taken from I(cache_file) (C(hits)), read out in full (C(misses))
+          and evicted from it (C(evicted)), only if I(cache_file) is set.
+    returned: success, when I(cache_file) is set
+    type: dict
+    sample: {"hits": 42, "misses": 3, "evicted": 0}
+yaml_backend:
+    description: The YAML backend used for parsing and dumping (C(libyaml) if available, otherwise C(python))
+    returned: success
+    type: string
+    sample: libyaml
 '''
 
 # pylint: disable=wrong-import-position
 # Python imports for module operation
 import os
+import re
 import sys
+import json
+import bisect
+import fnmatch
+import hashlib
+import signal
 import time
+import threading
+import tempfile
 import subprocess
 import yaml
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from http.client import HTTPConnection, HTTPException
+except ImportError:
+    from httplib import HTTPConnection, HTTPException
+
 try:
     from collections import OrderedDict
 except ImportError:
     OrderedDict = dict
 
+# Memory tracing is only available on Python 3.4+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Use the C-accelerated libyaml loader/dumper if PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+    from yaml import CSafeDumper as YamlDumper
+    YAML_BACKEND = 'libyaml'
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+    from yaml import SafeDumper as YamlDumper
+    YAML_BACKEND = 'python'
+
 # Python imports for Ansible
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils._text import to_bytes
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.k8s_exec import (
+    CommandTimeout, which_bash, process_group, stream_exec, shell_exec, run_pool, kubectl_resource
+)
 
 # Are we using Python2?
 PY2 = sys.version_info.major == 2
 
+# Timer for the per-phase timings (monotonic if available)
+TIMER = getattr(time, 'perf_counter', time.time)
+
+# Command outputs are spooled in memory up to this many bytes (on disk beyond),
+# copied from the pipe in chunks of SPOOL_CHUNK bytes
+SPOOL_SIZE = 1024 * 1024
+SPOOL_CHUNK = 64 * 1024
+
+# Maximum number of edits the line diff searches for, before it falls back
+# to replacing the remaining (differing) block as a whole
+DIFF_MAX_EDITS = 1000
+
 
 ################################################################################
 # Helper Classes
 ################################################################################
 
+class YdiffError(Exception):
+    '''
+    Raised for errors which only fail a single batch entry.
+    '''
+
+
+def ydiff_error(message):
+    '''
+    YdiffDict error function for batch mode (fails only the current entry).
+    '''
+    raise YdiffError(message)
+
+
 class SortedDict(OrderedDict):
     '''
     This class adds a custom recursive JSON sorter.
     JSON dicts are sorted recursively and alphabetically by key.
     '''
-    def __init__(self, **kwargs):
-        super(SortedDict, self).__init__()
+    def __init__(self, **kwargs):
+        super(SortedDict, self).__init__()
+
+        for key, value in sorted(kwargs.items()):
+            if isinstance(value, dict):
+                self[key] = SortedDict(**value)
+            else:
+                self[key] = value
+
+
+class IgnoreKeys(object):
+    '''
+    Compiled diff_ignore_keys matcher.
+
+    The nested ignore definition is compiled once into a trie of IgnoreKeys
+    nodes, so that documents can be pruned in a single traversal. Each key of
+    a node maps to one of:
+      IgnoreKeys.DELETE    Always remove the key
+      str                  Remove the key if it has exactly this value
+      IgnoreKeys           Descend into the value of the key
+
+    Keys containing shell-style wildcards (*, ?, [seq]) are matched as patterns
+    (e.g.: 'kubectl.kubernetes.io/*'). A plain '*' additionally matches every
+    element of a list. Dictionary definitions on lists apply to every element,
+    as does the single-element list notation (e.g.: containers: [{...}]).
+    '''
+    DELETE = object()
+
+    # Values which remove a key (dictionary) or an element (list) unconditionally
+    __empty_dict_vals = ['', '[]', '{}', None, [], {}]
+    __empty_list_vals = ['[]', '{}', None, [], {}]
+
+    # Values to be considered null (see YdiffDict)
+    __null_vals = ('None', 'null', 'Null', 'NULL')
+
+    def __init__(self, spec=None):
+        '''
+        Compile the ignore definition.
+
+        Args:
+          spec (dict|list|None): Ignore definition (as passed to diff_ignore_keys)
+        '''
+        self.keys = dict()
+        self.patterns = []
+        # What to do with list elements
+        self.item_delete = False
+        self.item_values = []
+        self.item_node = None
+
+        if isinstance(spec, dict):
+            for key, val in spec.items():
+                key = str(key)
+                val = self.__compile(val, self.__empty_dict_vals)
+                if key == '*':
+                    self.__add_item(val)
+                if any(char in key for char in '*?['):
+                    self.patterns.append((re.compile(fnmatch.translate(key)), val))
+                else:
+                    self.keys[key] = val
+            # Without an explicit '*', the definition applies to each list element
+            if '*' not in spec:
+                self.item_node = self
+
+        elif isinstance(spec, (list, tuple)):
+            # Multiple dictionary definitions are merged into one
+            merged = dict()
+            for val in spec:
+                if isinstance(val, dict):
+                    merged = merge_dicts(merged, val)
+                else:
+                    self.__add_item(self.__compile(val, self.__empty_list_vals))
+            if merged:
+                self.__add_item(IgnoreKeys(merged))
+
+    def __compile(self, val, empty_vals):
+        '''
+        Compile a single value of the ignore definition.
+        '''
+        if isinstance(val, (dict, list, tuple)) and val:
+            return IgnoreKeys(val)
+        if val in empty_vals:
+            return self.DELETE
+        val = str(val)
+        if val in self.__null_vals:
+            return self.DELETE
+        return val
+
+    def __add_item(self, val):
+        '''
+        Add a compiled value to what is matched against list elements.
+        '''
+        if val is self.DELETE:
+            self.item_delete = True
+        elif isinstance(val, IgnoreKeys):
+            self.item_node = val
+        else:
+            self.item_values.append(val)
+
+    def get(self, key):
+        '''
+        Return what to do with a dictionary key (None if it is not ignored).
+        '''
+        spec = self.keys.get(key)
+        if spec is None and self.patterns and key is not None:
+            for regex, pattern_spec in self.patterns:
+                if regex.match(key):
+                    return pattern_spec
+        return spec
+
+
+class IgnoreProfiles(object):
+    '''
+    Per-kind ignore keys. The compiled IgnoreKeys of a kind are built from the
+    '_all' profile, merged with the profile of the kind and the additional
+    ignore keys (which take precedence).
+    '''
+    def __init__(self, profiles, ignore_keys=None):
+        '''
+        Args:
+          profiles (dict):     Ignore keys by kind (with the optional '_all' profile)
+          ignore_keys (dict):  Ignore keys applied to all kinds
+        '''
+        self.__profiles = profiles or dict()
+        self.__ignore_keys = ignore_keys or dict()
+        self.__compiled = dict()
+
+    def get(self, kind):
+        '''
+        Return the compiled IgnoreKeys for a kind.
+        '''
+        if kind not in self.__compiled:
+            spec = merge_dicts(self.__profiles.get('_all') or dict(), self.__profiles.get(kind) or dict())
+            spec = merge_dicts(spec, self.__ignore_keys)
+            self.__compiled[kind] = IgnoreKeys(spec)
+        return self.__compiled[kind]
+
+
+class Timings(object):
+    '''
+    Wall time per phase (and per kind) and input sizes of a single diff.
+
+    Phases: fetch_source, fetch_target, parse, normalize, compare, dump and diff.
+    Targets which are fetched by a shared kubectl list call (target_type 'kubectl')
+    account the full duration of that call to every entry using it.
+    '''
+    def __init__(self):
+        self.__phases = OrderedDict()
+        self.__kinds = dict()
+        self.__sizes = dict()
+
+    def add(self, phase, seconds, kind=None):
+        '''
+        Add the duration of a phase (and account it to the kind of an object).
+        '''
+        self.__phases[phase] = self.__phases.get(phase, 0.0) + seconds
+        if kind is not None:
+            self.__kinds[kind] = self.__kinds.get(kind, 0.0) + seconds
+
+    def size(self, name, data):
+        '''
+        Record the size in bytes of an input (already loaded inputs are skipped).
+        '''
+        if isinstance(data, CommandOutput):
+            self.__sizes[name + '_bytes'] = data.size
+        elif is_str(data):
+            self.__sizes[name + '_bytes'] = len(to_bytes(data, errors='surrogate_or_strict'))
+
+    def result(self):
+        '''
+        Return the timings as module result.
+        '''
+        result = dict(
+            phases=dict((phase, round(secs, 6)) for phase, secs in self.__phases.items()),
+            kinds=dict((kind, round(secs, 6)) for kind, secs in self.__kinds.items()),
+            total=round(sum(self.__phases.values()), 6)
+        )
+        result.update(self.__sizes)
+        return result
+
+
+class MemoryTrace(object):
+    '''
+    Memory allocated during a module run, traced by tracemalloc (Python 3.4+).
+    Tracing slows down the run and is therefore only started on request.
+    '''
+    def __init__(self, enabled):
+        self.__tracing = bool(enabled) and tracemalloc is not None
+        self.__started = False
+        self.__base = 0
+        self.__blocks = 0
+        if self.__tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.__started = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.__base = tracemalloc.get_traced_memory()[0]
+            self.__blocks = sys.getallocatedblocks()
+
+    def result(self):
+        '''
+        Return the memory statistics since the start as module result.
+        '''
+        if not self.__tracing:
+            return dict()
+        current, peak = tracemalloc.get_traced_memory()
+        return dict(
+            peak_bytes=peak - self.__base,
+            retained_bytes=current - self.__base,
+            allocated_blocks=sys.getallocatedblocks() - self.__blocks
+        )
+
+    def stop(self):
+        '''
+        Stop tracing (only if it was started by this instance).
+        '''
+        if self.__started:
+            tracemalloc.stop()
+            self.__started = False
+
+
+class DocumentSizeError(Exception):
+    '''
+    Raised by CommandOutput.read() when a document exceeds max_document_size.
+    '''
+
+
+class CommandOutput(object):
+    '''
+    Output of a command, copied chunk by chunk from its stdout pipe into a spooled
+    temporary file (in memory up to SPOOL_SIZE bytes, on disk beyond), so that the
+    outputs of concurrently running commands are never held in memory as a whole.
+    Counts and hashes the bytes, flags anchors (shared nodes) and acts as read-only
+    file object from which the yaml loader streams the output, failing documents
+    larger than max_document_size bytes (accurate to one read chunk, 0 disables it).
+    '''
+    def __init__(self, pipe, max_document_size=0):
+        self.__spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.__max = max_document_size
+        self.__digest = hashlib.sha256()
+        self.__start = 0
+        self.__read = 0
+        self.size = 0
+        self.anchors = False
+        for chunk in iter(lambda: pipe.read(SPOOL_CHUNK), b''):
+            self.__spool.write(chunk)
+            self.__digest.update(chunk)
+            self.size += len(chunk)
+            if b'&' in chunk:
+                self.anchors = True
+        self.rewind()
+
+    def rewind(self):
+        '''
+        Start reading the output from its beginning.
+        '''
+        self.__spool.seek(0)
+        self.__start = self.__read = 0
+
+    def read(self, size=-1):
+        '''
+        Read the next chunk of the output.
+        '''
+        chunk = self.__spool.read(size)
+        self.__read += len(chunk)
+        if self.__max and self.__read - self.__start > self.__max:
+            raise DocumentSizeError('document larger than max_document_size (%d bytes)' % (self.__max))
+        return chunk
+
+    def document(self):
+        '''
+        Mark the start of the next document (the previous one is completely loaded).
+        '''
+        self.__start = self.__read
+
+    def digest(self):
+        '''
+        Return a copy of the sha256 digest of the output.
+        '''
+        return self.__digest.copy()
+
+
+class KubectlProxy(object):
+    '''
+    Long-lived 'kubectl proxy' of a kubectl base command (i.e.: per context and credentials).
+    All reads are sent to it as HTTP requests over keep-alive connections (one per thread),
+    so the kubeconfig loading, TLS handshake and API discovery are only done once per run
+    instead of once per kubectl call.
+    '''
+    __serving = re.compile(r'Starting to serve on ([^\s:]+):(\d+)')
+
+    # Metadata-only responses (PartialObjectMetadata), full objects if not supported
+    METADATA = 'application/json;as=PartialObjectMetadata;g=meta.k8s.io;v=v1,application/json'
+    METADATA_LIST = 'application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json'
+
+    def __init__(self, command, timeout=None):
+        '''
+        Args:
+          command (str):  kubectl base command (e.g.: 'kubectl --context=prod')
+          timeout (int):  Timeout in seconds to start the proxy and for every request (0: none)
+        '''
+        self.__command = command
+        self.__timeout = timeout or None
+        self.__proc = None
+        self.__address = None
+        self.__namespace = None
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__connections = []
+        self.__discovery = threading.Lock()
+        self.__resources = dict()
+
+    def start(self):
+        '''
+        Start the proxy on a random local port and read out the default namespace of the context.
+        '''
+        self.__proc = subprocess.Popen(
+            '%s proxy --port=0' % (self.__command),
+            executable=which_bash(),
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **process_group()
+        )
+        timer = None
+        if self.__timeout:
+            timer = threading.Timer(self.__timeout, self.stop)
+            timer.start()
+        try:
+            line = to_native(self.__proc.stdout.readline())
+        finally:
+            if timer is not None:
+                timer.cancel()
+        match = self.__serving.search(line)
+        if match is None:
+            self.stop()
+            raise YdiffError('kubectl proxy failed: %s' % (to_native(self.__proc.stderr.read()).strip()))
+        self.__address = (match.group(1), int(match.group(2)))
+
+        # Discard all further output, so that the proxy never blocks on a full pipe
+        for pipe in (self.__proc.stdout, self.__proc.stderr):
+            drain = threading.Thread(target=self.__drain, args=(pipe,))
+            drain.daemon = True
+            drain.start()
+
+        command = '%s config view --minify -o %s' % (self.__command, quote('jsonpath={..namespace}'))
+        ret, stdout, _ = shell_exec(command, self.__timeout)
+        self.__namespace = (ret == 0 and to_native(stdout).strip()) or 'default'
+
+    def __drain(self, pipe):
+        '''
+        Read a pipe of the proxy until it is closed.
+        '''
+        while pipe.read(SPOOL_CHUNK):
+            pass
+
+    def stop(self):
+        '''
+        Close all connections and terminate the proxy.
+        '''
+        with self.__lock:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections = []
+        if self.__proc is not None and self.__proc.poll() is None:
+            try:
+                os.killpg(self.__proc.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            self.__proc.wait()
+
+    def __connection(self, renew=False):
+        '''
+        Return the keep-alive connection of the current thread.
+        '''
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None or renew:
+            if conn is not None:
+                conn.close()
+            conn = HTTPConnection(self.__address[0], self.__address[1], timeout=self.__timeout)
+            self.__local.conn = conn
+            with self.__lock:
+                self.__connections.append(conn)
+        return conn
+
+    def get(self, path, accept='application/json'):
+        '''
+        GET an API path and return the decoded JSON response (None if not found).
+        A connection closed by the proxy in between is reopened once.
+        '''
+        for renew in (False, True):
+            conn = self.__connection(renew)
+            try:
+                conn.request('GET', path, headers={'Accept': accept})
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (HTTPException, IOError, OSError) as err:
+                if renew:
+                    raise YdiffError('target request %s failed: %s' % (path, err))
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise YdiffError('target request %s failed: %s %s' % (path, response.status, to_native(body)))
+        return json.loads(to_native(body))
+
+    def resource(self, api_version, kind):
+        '''
+        Return the API path and whether a kind is namespaced, discovered once per group version.
+        '''
+        base = '/api/%s' % (api_version) if '/' not in api_version else '/apis/%s' % (api_version)
+        with self.__discovery:
+            if api_version not in self.__resources:
+                found = self.get(base) or dict()
+                self.__resources[api_version] = dict(
+                    (res['kind'], (res['name'], res.get('namespaced', False)))
+                    for res in found.get('resources', []) if '/' not in res['name']
+                )
+        if kind not in self.__resources[api_version]:
+            raise YdiffError('target: the server doesn\'t have a resource type "%s" in %s' % (kind, api_version))
+        name, namespaced = self.__resources[api_version][kind]
+        return base, name, namespaced
+
+    def __path(self, api_version, kind, namespace=None):
+        '''
+        Return the API path of a kind (in the given or the default namespace of the context).
+        '''
+        if not api_version:
+            raise YdiffError('kubectl_proxy requires the apiVersion of all objects')
+        base, resource, namespaced = self.resource(api_version, kind)
+        if namespaced:
+            return '%s/namespaces/%s/%s' % (base, namespace or self.__namespace, resource)
+        return '%s/%s' % (base, resource)
+
+    def list(self, api_version, kind, namespace=None, names=None):
+        '''
+        List all objects of a kind (in the given or the default namespace of the context)
+        or only get the objects of the given names (objects not found are left out).
+        '''
+        path = self.__path(api_version, kind, namespace)
+        if names is not None:
+            items = [item for item in (self.get('%s/%s' % (path, name)) for name in names) if item]
+        else:
+            items = (self.get(path) or dict()).get('items') or []
+        # Items of a list do not contain their apiVersion and kind
+        for item in items:
+            item.setdefault('apiVersion', api_version)
+            item.setdefault('kind', kind)
+        return items
+
+    def versions(self, api_version, kind, namespace=None, names=None):
+        '''
+        Same as list(), but only read out the metadata of the objects (the server falls back
+        to the full objects if it does not support it) and return their resourceVersion by name.
+        '''
+        path = self.__path(api_version, kind, namespace)
+        if names is not None:
+            items = [item for item in (self.get('%s/%s' % (path, name), self.METADATA) for name in names) if item]
+        else:
+            items = (self.get(path, self.METADATA_LIST) or dict()).get('items') or []
+        return dict(
+            (item['metadata'].get('name'), item['metadata'].get('resourceVersion'))
+            for item in items if isinstance(item.get('metadata'), dict)
+        )
+
+
+class StateStore(object):
+    '''
+    Fingerprints of the batch entries which converged (deployed objects equal to the
+    source) in previous runs, kept in a JSON file. An entry whose source and deployed
+    objects still have the same fingerprints is known to be unchanged without diffing it.
+    '''
+    VERSION = 1
+
+    def __init__(self, path):
+        '''
+        Load the state file (a missing, unreadable or outdated file is an empty state).
+        '''
+        self.__path = path
+        self.__entries = dict()
+        try:
+            with open(path, 'rb') as stream:
+                data = json.loads(to_native(stream.read()))
+            if isinstance(data, dict) and data.get('version') == self.VERSION:
+                self.__entries = data.get('entries') or dict()
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get(self, key):
+        '''
+        Return the stored state of an entry (or None).
+        '''
+        return self.__entries.get(key)
+
+    def set(self, key, state):
+        '''
+        Store the state of a converged entry.
+        '''
+        self.__entries[key] = state
+
+    def remove(self, key):
+        '''
+        Forget an entry that did not converge.
+        '''
+        self.__entries.pop(key, None)
+
+    def save(self):
+        '''
+        Write the state file atomically.
+        '''
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        data = json.dumps(dict(version=self.VERSION, entries=self.__entries), indent=2, sort_keys=True)
+        temp = '%s.%d.tmp' % (self.__path, os.getpid())
+        with open(temp, 'wb') as stream:
+            stream.write(to_bytes(data))
+        os.rename(temp, self.__path)
+
+
+class LiveCache(object):
+    '''
+    Normalized deployed objects of previous runs, kept in a JSON file per context (kubectl
+    command) and keyed by their identity together with their resourceVersion. An object whose
+    resourceVersion is unchanged is taken from the cache instead of being read out and parsed again.
+    Secrets are never cached. Contexts are stored by the hash of their command (which can
+    contain credentials), the least recently used objects are evicted beyond max_size bytes.
+    '''
+    VERSION = 1
+
+    def __init__(self, path, max_size=0):
+        '''
+        Load the cache file (a missing, unreadable or outdated file is an empty cache).
+        '''
+        self.__path = path
+        self.__max_size = max_size
+        self.__contexts = dict()
+        self.__lock = threading.Lock()
+        self.__stats = dict(hits=0, misses=0, evicted=0)
+        try:
+            with open(path, 'rb') as stream:
+                data = json.loads(to_native(stream.read()))
+            if isinstance(data, dict) and data.get('version') == self.VERSION:
+                self.__contexts = data.get('contexts') or dict()
+        except (IOError, OSError, ValueError):
+            pass
+
+    def __context(self, command, create=False):
+        '''
+        Return the cached objects of a context (None if there are none and not create).
+        '''
+        key = hashlib.sha256(to_bytes(command, errors='surrogate_or_strict')).hexdigest()
+        if create:
+            return self.__contexts.setdefault(key, dict())
+        return self.__contexts.get(key)
+
+    def flush(self, command):
+        '''
+        Invalidate all cached objects of a context.
+        '''
+        with self.__lock:
+            objects = self.__context(command)
+            if objects:
+                objects.clear()
+
+    def get(self, command, ident, version):
+        '''
+        Return the cached object of an identity if its resourceVersion is unchanged (or None).
+        '''
+        with self.__lock:
+            objects = self.__context(command) or dict()
+            cached = objects.get(json.dumps(ident))
+            if cached is None or version is None or cached.get('version') != version:
+                self.__stats['misses'] += 1
+                return None
+            self.__stats['hits'] += 1
+            cached['used'] = time.time()
+            return cached['object']
+
+    def set(self, command, ident, version, obj):
+        '''
+        Store the normalized object of an identity (objects without resourceVersion and Secrets
+        are not stored).
+        '''
+        if version is None or ident[1] == 'Secret':
+            return
+        with self.__lock:
+            self.__context(command, True)[json.dumps(ident)] = dict(
+                version=version,
+                object=obj,
+                size=len(json.dumps(obj)),
+                used=time.time()
+            )
+
+    def remove(self, command, ident):
+        '''
+        Forget the object of an identity (e.g.: it is not deployed anymore).
+        '''
+        with self.__lock:
+            (self.__context(command) or dict()).pop(json.dumps(ident), None)
+
+    def stats(self):
+        '''
+        Return the number of hits, misses and evicted objects of this run.
+        '''
+        return dict(self.__stats)
+
+    def save(self):
+        '''
+        Evict the least recently used objects beyond max_size and write the cache file
+        atomically (only readable by its owner).
+        '''
+        if self.__max_size:
+            entries = sorted(
+                ((cached['used'], context, key, cached['size'])
+                 for context, objects in self.__contexts.items() for key, cached in objects.items()),
+                reverse=True
+            )
+            size = 0
+            for _, context, key, entry_size in entries:
+                size += entry_size
+                if size > self.__max_size:
+                    del self.__contexts[context][key]
+                    self.__stats['evicted'] += 1
+        self.__contexts = dict((key, objects) for key, objects in self.__contexts.items() if objects)
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        data = json.dumps(dict(version=self.VERSION, contexts=self.__contexts), sort_keys=True)
+        temp = '%s.%d.tmp' % (self.__path, os.getpid())
+        with os.fdopen(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as stream:
+            stream.write(to_bytes(data))
+        os.rename(temp, self.__path)
+
+
+class ObjectIndex(object):
+    '''
+    Index of Kubernetes objects keyed by their identity (apiVersion, kind, namespace, name).
+
+    Lookups fall back to a relaxed match on (kind, name), in order to find objects
+    served in a different apiVersion or without an explicit namespace in the template.
+    '''
+    def __init__(self, docs=None):
+        self.__objects = OrderedDict()
+        self.__by_name = dict()
+        for doc in docs or []:
+            self.add(doc)
 
-        for key, value in sorted(kwargs.items()):
-            if isinstance(value, dict):
-                self[key] = SortedDict(**value)
-            else:
-                self[key] = value
+    def add(self, doc):
+        '''
+        Add a Kubernetes object to the index.
+        '''
+        ident = identity(doc)
+        self.__objects[ident] = doc
+        self.__by_name.setdefault((ident[1], ident[3]), []).append(ident)
+
+    def pop(self, ident):
+        '''
+        Remove and return the object matching the identity (None if not found).
+        '''
+        if ident not in self.__objects:
+            api_version, kind, namespace, name = ident
+            candidates = [
+                other for other in self.__by_name.get((kind, name), [])
+                if other in self.__objects and (not namespace or other[2] == namespace)
+            ]
+            if not candidates:
+                return None
+            ident = candidates[0]
+        return self.__objects.pop(ident)
+
+    def remaining(self):
+        '''
+        Return all objects that have not been popped.
+        '''
+        return list(self.__objects.values())
 
 
 class YdiffDict(object):
@@ -186,6 +1221,21 @@ class YdiffDict(object):
     # Note that [''] is omitted as it is a valid list element
     __empty_list_vals = ['[]', '{}', None, [], {}]
 
+    # String values which are normalized to None
+    __null_vals = ('None', 'null', 'Null', 'NULL')
+    __str_types = basestring if PY2 else str # pylint: disable=undefined-variable
+
+    # The libyaml emitter produces the exact same output as the pure-Python
+    # emitter, except for long or non-printable keys and for unicode line
+    # breaks or characters outside the BMP. Documents containing any of those
+    # are dumped with the pure-Python emitter.
+    __c_key = re.compile(r'^[\x20-\x7e]{1,120}$')
+    __c_val = re.compile(u'[\x85\u2028\u2029\ud800-\udfff]|[^\x00-\uffff]')
+    __c_emittable = False
+
+    # Do not wrap long lines (libyaml and Python count the line width differently)
+    __width = 2147483647
+
 
     def __error(self, message):
         '''
@@ -197,49 +1247,222 @@ class YdiffDict(object):
         else:
             self.__err_func(message)
 
+    def __scalar(self, obj):
+        '''
+        Normalize an absolute value: null literals become None, everything
+        else (integer, floats, etc) is stringified.
+        '''
+        # Only strings can be null literals
+        if isinstance(obj, self.__str_types) and obj in self.__null_vals:
+            return None
+        return str(obj)
+
+    def __emittable(self, val, is_key=False):
+        '''
+        Clear the libyaml emitter flag if a normalized key or value cannot be dumped by it.
+        '''
+        if is_key:
+            if val is None or not self.__c_key.match(val):
+                self.__c_emittable = False
+        elif val is not None and self.__c_val.search(val):
+            self.__c_emittable = False
+
     def __normalize(self, obj):
         '''
         Convert all possible null values to an empty string
         to be safe when converting to JSON or Yaml.
         Additionally convert all non string values (integer, floats, etc) to string.
+        The tree is walked without recursion and a normalized copy is returned.
         '''
-        # Ensure JSON null values are converted to Python None values
-        if obj in ('None', 'null', 'Null', 'NULL'):
-            return None
-        # Recurse for lists and tuples
-        if isinstance(obj, (list, tuple)):
-            return [self.__normalize(item) for item in obj]
-        # Recurse for dictionaries
-        if isinstance(obj, dict):
-            return dict((self.__normalize(key), self.__normalize(val)) for key, val in obj.items())
-        # Stringify everything else
-        return str(obj)
+        if not isinstance(obj, (dict, list, tuple)):
+            obj = self.__scalar(obj)
+            if self.__c_emittable:
+                self.__emittable(obj)
+            return obj
+
+        root = dict() if isinstance(obj, dict) else list()
+        stack = [(obj, root)]
+        while stack:
+            node, result = stack.pop()
+            is_dict = isinstance(node, dict)
+            for key, val in (node.items() if is_dict else enumerate(node)):
+                if isinstance(val, (dict, list, tuple)):
+                    child = dict() if isinstance(val, dict) else list()
+                    stack.append((val, child))
+                    val = child
+                else:
+                    val = self.__scalar(val)
+                    if self.__c_emittable:
+                        self.__emittable(val)
+                if is_dict:
+                    key = self.__scalar(key)
+                    if self.__c_emittable:
+                        self.__emittable(key, True)
+                    result[key] = val
+                else:
+                    result.append(val)
+        return root
+
+    def __prune(self, obj, ignore, empty, digest=0, inplace=False):
+        '''
+        Normalize obj, remove ignored keys and (optionally) empty keys
+        in a single traversal. A non-empty field that turns into an empty one
+        after its children got removed is removed as well.
+        The tree is walked without recursion: every container gets a frame on
+        an explicit stack and its pruned value is stored into its parent once
+        all of its children are done.
+
+        Args:
+          obj (any):                 The (not yet normalized) object
+          ignore (IgnoreKeys|None):  Compiled ignore keys at the level of obj
+          empty (bool):              Remove empty keys
+          digest (int):              Replace values larger than this many bytes by their digest (0: never)
+          inplace (bool):            Reuse the dicts and lists of obj instead of copying them
+                                     (only for documents owned by the caller without shared nodes)
+        Returns:
+          any                        Normalized and pruned obj
+        '''
+        if not isinstance(obj, (dict, list, tuple)):
+            return self.__scalar(obj)
+
+        def frame(node, spec):
+            '''
+            Return the frame of a container: [items, result, ignore, pending key, pending spec].
+            '''
+            if isinstance(node, dict):
+                items = node.items()
+                result = dict()
+                if inplace:
+                    items = list(items)
+                    node.clear()
+                    result = node
+            else:
+                items = node if spec is None or not spec.item_delete else ()
+                result = list()
+                if inplace and isinstance(node, list):
+                    items = list(items)
+                    del node[:]
+                    result = node
+            return [iter(items), result, spec, None, None]
+
+        def store(parent, key, spec, val):
+            '''
+            Store the pruned value of a key (or list element) into its parent container.
+            '''
+            result = parent[1]
+            if isinstance(result, dict):
+                # Ignored key with a specific value
+                if spec is not None and not isinstance(spec, IgnoreKeys) and spec == val:
+                    return
+                # Empty key
+                if empty and val in self.__empty_dict_vals:
+                    return
+                result[key] = self.__digest(val, digest) if digest else val
+            else:
+                # Ignored element with a specific value
+                if parent[2] is not None and parent[2].item_values and val in parent[2].item_values:
+                    return
+                # Empty element
+                if empty and val in self.__empty_list_vals:
+                    return
+                result.append(self.__digest(val, digest) if digest else val)
+
+        scalar = self.__scalar
+        root = frame(obj, ignore)
+        stack = [root]
+        while stack:
+            current = stack[-1]
+            items, result, node_ignore = current[0], current[1], current[2]
+            is_dict = isinstance(result, dict)
+            item_node = node_ignore.item_node if node_ignore is not None and not is_dict else None
+            for item in items:
+                if is_dict:
+                    key = scalar(item[0])
+                    val = item[1]
+                    spec = node_ignore.get(key) if node_ignore is not None else None
+                    # Ignored key
+                    if spec is IgnoreKeys.DELETE:
+                        continue
+                    # Dive into a deeper level only with compiled ignore keys
+                    child_ignore = spec if isinstance(spec, IgnoreKeys) else None
+                else:
+                    key, val, spec, child_ignore = None, item, None, item_node
+                if isinstance(val, (dict, list, tuple)):
+                    current[3], current[4] = key, spec
+                    stack.append(frame(val, child_ignore))
+                    break
+                store(current, key, spec, scalar(val))
+            else:
+                # All children are done: hand the pruned container to its parent
+                stack.pop()
+                if stack:
+                    store(stack[-1], stack[-1][3], stack[-1][4], result)
+        return root[1]
+
+    def __digest(self, val, size):
+        '''
+        Replace a (normalized) value larger than size bytes by its digest.
+        '''
+        if not size or not is_str(val) or len(val) <= size // 4:
+            return val
+        if len(to_bytes(val, errors='surrogate_or_strict')) <= size:
+            return val
+        return self.digest(val)
+
+    def __unshared(self, string):
+        '''
+        Check if the documents loaded from a yaml string cannot contain shared nodes
+        (anchors and aliases), which must not be pruned in place.
+        '''
+        return (b'&' if isinstance(string, bytes) else '&') not in string
+
+    def __is_list(self, doc):
+        '''
+        Check if a document is a Kubernetes List (e.g.: from kubectl get -o yaml).
+        '''
+        return (
+            isinstance(doc, dict) and
+            str(doc.get('kind', '')).endswith('List') and
+            isinstance(doc.get('items'), list) and
+            not (doc.get('metadata') or {}).get('name')
+        )
 
     def __dict_to_yaml_str(self, obj):
         '''
         Convert a dictionary to a human readable yaml string.
         '''
+        self.__c_emittable = YAML_BACKEND == 'libyaml'
         obj = self.__normalize(obj)
+        if self.__c_emittable and isinstance(obj, (dict, list)):
+            dumper = YamlDumper
+        else:
+            dumper = yaml.SafeDumper
         try:
-            obj = yaml.dump(obj, default_flow_style=False, allow_unicode=True)
+            obj = yaml.dump(
+                obj,
+                Dumper=dumper,
+                default_flow_style=False,
+                allow_unicode=True,
+                width=self.__width
+            )
         except yaml.YAMLError as err:
-            self.__error(err)
+            self.__error(to_native(err))
         return obj
 
-    def __yaml_str_to_dict(self, string):
+    def __yaml_str_to_dict(self, string, ignore=None, empty=False):
         '''
-        Convert a yaml string to a Python dictionary
+        Convert a yaml string to a normalized and pruned Python dictionary
         '''
         try:
-            # Load string into object
-            obj = yaml.load(string)
-            obj = self.__normalize(obj)
+            # Load string into object (owned by us, pruned in place unless it has shared nodes)
+            obj = yaml.load(string, Loader=YamlLoader)
+            obj = self.__prune(obj, ignore, empty, inplace=self.__unshared(string))
             # Handle empty dict
             if obj is None:
                 return {}
             return obj
         except yaml.YAMLError as err:
-            self.__error(err)
+            self.__error(to_native(err))
 
     ############################################################
     # Constructor
@@ -267,115 +1490,486 @@ class YdiffDict(object):
         '''
         return self.__dict_to_yaml_str(obj)
 
-    def yaml2dict(self, string):
+    def yaml2dict(self, string, ignore_keys=None, ignore_empty=False):
         '''
-        Convert a yaml string to a Python dictionary.
+        Convert a yaml string to a normalized Python dictionary.
+
+        Args:
+          string (str|dict):              The yaml string to convert
+          ignore_keys (IgnoreKeys|None):  Compiled ignore keys to remove
+          ignore_empty (bool):            Remove empty keys
+        Returns:
+          dict                            Normalized dictionary
         '''
-        # Make all dicts a string first
+        # Normalize dicts directly (same result as dumping and loading them again)
+        # and prune the normalized copy in place
         if isinstance(string, dict):
-            string = self.__dict_to_yaml_str(string)
+            return self.__prune(self.__normalize(string), ignore_keys, ignore_empty, inplace=True)
 
-        return self.__yaml_str_to_dict(string)
+        return self.__yaml_str_to_dict(string, ignore_keys, ignore_empty)
 
-    def del_ignore_keys(self, src_dict, del_dict):
+    def yaml2docs(self, string, ignore_keys=None, ignore_empty=False, digest_size=0, digest_secrets=False,
+                  timings=None):
         '''
-        Removes any keys from the src_dict that are present and empty within the
-        del_dict or have the same value in src_dict and del_dict.
+        Convert a (multi-document) yaml string to a list of normalized documents.
+        Empty documents are skipped and Kubernetes List objects are flattened
+        into their items.
 
         Args:
-          src_dict (dict): The dictionary to delete keys on
-          del_dict (dict): The dictionary that specifies the keys to delete
+          string (str|CommandOutput|list):                The yaml string or command output to convert
+                                                          (or already loaded documents)
+          ignore_keys (IgnoreKeys|IgnoreProfiles|None):   Compiled ignore keys to remove
+          ignore_empty (bool):                            Remove empty keys
+          digest_size (int):                              Replace values larger than this many bytes
+                                                          by their digest (0: never)
+          digest_secrets (bool):                          Replace all values of Secrets by their digest
+          timings (Timings|None):                         Add the 'parse' and 'normalize' durations
         Returns:
-          dict             Cleaned dictionary
+          list                                            Normalized documents
         '''
-        result_dict = dict()
-
-        # Handle dictionaries
-        if isinstance(src_dict, dict) and isinstance(del_dict, dict):
-            for key, src_val in src_dict.items():
-                # Check if the key can be removed
-                try:
-                    del_val = del_dict[key]
-                    # If dict/list recurse
-                    if isinstance(src_val, (dict, list)) and isinstance(del_val, (dict, list)):
-                        result_dict[key] = self.del_ignore_keys(src_val, del_val)
-                    # If the del value is empty, do not add to the resulting dict (delete operation)
-                    elif del_val in self.__empty_dict_vals:
-                        continue
-                    # If we have a match, do not add to the resulting dict (delete operation)
-                    elif del_val == src_val:
+        start = TIMER()
+        docs = []
+        # Already loaded documents might be shared, loaded ones are owned and pruned in place
+        inplace = False
+        if isinstance(string, list):
+            docs.extend(string)
+        else:
+            # Command outputs are streamed into the loader (one document at a time)
+            stream = isinstance(string, CommandOutput)
+            if stream:
+                inplace = not string.anchors
+                string.rewind()
+            else:
+                inplace = self.__unshared(string)
+            try:
+                for doc in yaml.load_all(string, Loader=YamlLoader):
+                    if stream:
+                        string.document()
+                    if doc is None:
                         continue
-                    # No match so far, add it to the result dict (keep operation)
+                    if self.__is_list(doc):
+                        docs.extend(doc['items'])
                     else:
-                        result_dict[key] = src_val
-                # Key is not specified in del_dict, so keep it
-                except KeyError:
-                    result_dict[key] = src_val
-
-        # Handle lists
-        elif isinstance(src_dict, list) and isinstance(del_dict, list) and len(del_dict) == 1:
-            del_val = del_dict[0]
-            for idx in reversed(range(len(src_dict))):
-                src_val = src_dict[idx]
-
-                # If dict/list recurse
-                if isinstance(src_val, (dict, list)) and isinstance(del_val, (dict, list)):
-                    result_dict[idx] = self.del_ignore_keys(src_val, del_val)
-                # If the del value is empty, do not add to the resulting dict (delete operation)
-                elif del_val in self.__empty_list_vals:
-                    continue
-                # If we have a match, do not add to the resulting dict (delete operation)
-                elif del_val == src_val:
-                    continue
-                # No match so far, add it to the result dict (keep operation)
-                else:
-                    result_dict[key] = src_val
+                        docs.append(doc)
+            except (yaml.YAMLError, DocumentSizeError) as err:
+                self.__error(to_native(err))
+
+        if timings is not None:
+            timings.add('parse', TIMER() - start)
+
+        # Release every loaded document once its pruned copy exists
+        result = []
+        for idx, doc in enumerate(docs):
+            docs[idx] = None
+            start = TIMER()
+            ignore = ignore_keys
+            if isinstance(ignore_keys, IgnoreProfiles):
+                ignore = ignore_keys.get(str(doc.get('kind')) if isinstance(doc, dict) else None)
+            doc = self.__prune(doc, ignore, ignore_empty, digest_size, inplace)
+            if digest_secrets and isinstance(doc, dict) and doc.get('kind') == 'Secret':
+                for key in ('data', 'stringData'):
+                    if isinstance(doc.get(key), dict):
+                        doc[key] = dict((name, self.digest(val)) for name, val in doc[key].items())
+            if timings is not None:
+                timings.add('normalize', TIMER() - start, doc.get('kind') if isinstance(doc, dict) else None)
+            result.append(doc)
+        return result
+
+    def del_ignore_keys(self, src_dict, del_dict):
+        '''
+        Removes any keys from the src_dict that are present and empty within the
+        del_dict or have the same value in src_dict and del_dict.
 
-        # Neither dict nor list, its an absolute value that can be returned
-        return result_dict
+        Args:
+          src_dict (dict):             The dictionary to delete keys on
+          del_dict (dict|IgnoreKeys):  The dictionary that specifies the keys to delete
+        Returns:
+          dict                         Cleaned dictionary
+        '''
+        if not isinstance(del_dict, IgnoreKeys):
+            del_dict = IgnoreKeys(del_dict)
+        return self.__prune(src_dict, del_dict, False)
 
     def del_empty_keys(self, obj):
         '''
         Recursively remove all empty fields from a nested
         dict structure. Note, a non-empty field could turn
         into an empty one after its children deleted.
-        https://stackoverflow.com/a/27974067
 
         Args:
           obj (dict): The dictionary to delete keys on
         Returns:
           dict        Cleaned dictionary
         '''
-        if isinstance(obj, dict):
-            for key, val in obj.items():
-
-                # Dive into a deeper level
-                if isinstance(val, (dict, list)):
-                    val = self.del_empty_keys(val)
-
-                # Delete the field if it's empty
-                if val in self.__empty_dict_vals:
-                    del obj[key]
+        return self.__prune(obj, None, True)
 
-        elif isinstance(obj, list):
-            for idx in reversed(range(len(obj))):
-                val = obj[idx]
+    def digest(self, val):
+        '''
+        Return the digest of a (normalized) value as shown in the diff: '<sha256:<hex> <size> bytes>'.
+        Values which are not strings are returned unchanged.
+        '''
+        if not is_str(val):
+            return val
+        data = to_bytes(val, errors='surrogate_or_strict')
+        return '<sha256:%s %d bytes>' % (hashlib.sha256(data).hexdigest(), len(data))
 
-                # Dive into a deeper level
-                if isinstance(val, (dict, list)):
-                    val = self.del_empty_keys(val)
+    def compare(self, source, target, path=''):
+        '''
+        Structurally compare two normalized documents without serializing them.
+        Equal subtrees are skipped as a whole, so unchanged documents return
+        after a single comparison. The trees are walked without recursion
+        (like by __prune), subtrees too deep to be compared at once are
+        compared key by key.
 
-                # Delete the field if it's empty
-                if val in self.__empty_list_vals:
-                    obj.pop(idx)
+        Args:
+          source (dict): The wanted document (e.g.: local template)
+          target (dict): The current document (e.g.: deployed template)
+          path (str):    JSON-Pointer prefix of the compared documents
+        Returns:
+          list           Changes to turn target into source, each as a dict with
+                         'op' (add, remove or replace) and 'path' (JSON-Pointer)
+        '''
+        missing = object()
+
+        def equal(source, target):
+            '''
+            Compare two subtrees at once (not equal if they exceed the recursion limit).
+            '''
+            try:
+                return source == target
+            except RuntimeError:
+                # RecursionError (Python 3.5+) is a RuntimeError
+                return False
+
+        changes = []
+        stack = [(source, target, path)]
+        while stack:
+            source, target, path = stack.pop()
+            if target is missing:
+                changes.append({'op': 'add', 'path': path})
+                continue
+            if source is missing:
+                changes.append({'op': 'remove', 'path': path})
+                continue
+            if equal(source, target):
+                continue
+
+            # Handle dictionaries (children are pushed in reverse to pop them in order)
+            if isinstance(source, dict) and isinstance(target, dict):
+                for key in sorted(set(source) | set(target), key=str, reverse=True):
+                    stack.append((
+                        source.get(key, missing),
+                        target.get(key, missing),
+                        path + '/' + str(key).replace('~', '~0').replace('/', '~1')
+                    ))
+
+            # Handle lists
+            elif isinstance(source, list) and isinstance(target, list):
+                for idx in reversed(range(max(len(source), len(target)))):
+                    stack.append((
+                        source[idx] if idx < len(source) else missing,
+                        target[idx] if idx < len(target) else missing,
+                        path + '/' + str(idx)
+                    ))
+
+            # Different types or values
+            else:
+                changes.append({'op': 'replace', 'path': path})
 
-        return obj
+        return changes
 
 
 ################################################################################
 # Helper Functions
 ################################################################################
 
+def merge_dicts(base, other):
+    '''
+    Recursively merge two dictionaries (other takes precedence).
+    Lists are not merged, but replaced (same as Jinja's combine(recursive=True)).
+    '''
+    result = dict(base)
+    for key, val in other.items():
+        if isinstance(val, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_dicts(result[key], val)
+        else:
+            result[key] = val
+    return result
+
+
+def identity(doc):
+    '''
+    Return the identity (apiVersion, kind, namespace, name) of a Kubernetes object
+    or None if the document is not a Kubernetes object.
+    '''
+    if not isinstance(doc, dict) or not isinstance(doc.get('metadata'), dict):
+        return None
+    if doc.get('kind') is None or doc['metadata'].get('name') is None:
+        return None
+    return (
+        doc.get('apiVersion'),
+        doc.get('kind'),
+        doc['metadata'].get('namespace'),
+        doc['metadata'].get('name')
+    )
+
+
+def identity_name(ident):
+    '''
+    Human readable name of an object identity: 'Kind namespace/name'
+    '''
+    api_version, kind, namespace, name = ident
+    if namespace:
+        return '%s %s/%s' % (kind, namespace, name)
+    return '%s %s' % (kind, name)
+
+
+def fingerprint(data, params=None):
+    '''
+    Return the sha256 fingerprint of a source or target input. Inputs which are already
+    loaded deployed objects (target_type 'kubectl') are fingerprinted by their identity
+    and resourceVersion, command outputs by their raw bytes. If params are given, the
+    options which affect the diff result are part of the fingerprint.
+    '''
+    if isinstance(data, CommandOutput):
+        digest = data.digest()
+    else:
+        if isinstance(data, list):
+            data = '\n'.join(sorted(
+                json.dumps([identity(doc), (doc.get('metadata') or dict()).get('resourceVersion')])
+                for doc in data if isinstance(doc, dict)
+            ))
+        digest = hashlib.sha256(to_bytes(data, errors='surrogate_or_strict'))
+    if params is not None:
+        options = dict((key, params.get(key)) for key in (
+            'diff_ignore_keys', 'diff_ignore_profiles', 'diff_ignore_empty', 'diff_digest_size', 'diff_digest_secrets'
+        ))
+        digest.update(to_bytes(json.dumps(options, sort_keys=True, default=str)))
+    return digest.hexdigest()
+
+
+def match_documents(source_docs, target_docs):
+    '''
+    Pair up source and target documents.
+    Kubernetes objects are matched by their identity, everything else by position.
+
+    Returns:
+      list    List of (source, target) tuples, with None for a missing counterpart
+    '''
+    docs = source_docs + target_docs
+    if not docs or any(identity(doc) is None for doc in docs):
+        pairs = []
+        for idx in range(max(len(source_docs), len(target_docs))):
+            pairs.append((
+                source_docs[idx] if idx < len(source_docs) else None,
+                target_docs[idx] if idx < len(target_docs) else None
+            ))
+        return pairs
+
+    index = ObjectIndex(target_docs)
+    pairs = [(doc, index.pop(identity(doc))) for doc in source_docs]
+    pairs.extend((None, doc) for doc in index.remaining())
+    return pairs
+
+
+def common_anchors(before, after):
+    '''
+    Longest sequence of lines which occur exactly once in both lists and in the same order
+    (patience diff anchors).
+
+    Returns:
+      list:  (index before, index after) tuples
+    '''
+    unique_a = dict()
+    for idx, line in enumerate(before):
+        unique_a[line] = idx if line not in unique_a else None
+    unique_b = dict()
+    for idx, line in enumerate(after):
+        if unique_a.get(line) is not None:
+            unique_b[line] = idx if line not in unique_b else None
+    pairs = sorted((unique_a[line], idx) for line, idx in unique_b.items() if idx is not None)
+
+    # Longest increasing subsequence of the after indexes (patience sorting)
+    tails = []
+    tail_pairs = []
+    previous = []
+    for pair in pairs:
+        pos = bisect.bisect_left(tails, pair[1])
+        previous.append(tail_pairs[pos - 1] if pos else None)
+        if pos == len(tails):
+            tails.append(pair[1])
+            tail_pairs.append(len(previous) - 1)
+        else:
+            tails[pos] = pair[1]
+            tail_pairs[pos] = len(previous) - 1
+    anchors = []
+    node = tail_pairs[-1] if tail_pairs else None
+    while node is not None:
+        anchors.append(pairs[node])
+        node = previous[node]
+    anchors.reverse()
+    return anchors
+
+
+def myers_diff(before, after, max_edits=DIFF_MAX_EDITS):
+    '''
+    Shortest line edit script between two lists of lines (Myers' O(ND) algorithm).
+    If more than max_edits edits are required, all lines are reported as removed and added.
+
+    Returns:
+      list:  (op, line) tuples with op being ' ' (equal), '-' (removed) or '+' (added)
+    '''
+    # Find the furthest reaching path for an increasing number of edits
+    len_a, len_b = len(before), len(after)
+    vertex = {1: 0}
+    trace = []
+    for edits in range(0, min(len_a + len_b, max_edits) + 1):
+        trace.append(dict(vertex))
+        for diag in range(-edits, edits + 1, 2):
+            if diag == -edits or (diag != edits and vertex[diag - 1] < vertex[diag + 1]):
+                pos_a = vertex[diag + 1]
+            else:
+                pos_a = vertex[diag - 1] + 1
+            pos_b = pos_a - diag
+            while pos_a < len_a and pos_b < len_b and before[pos_a] == after[pos_b]:
+                pos_a += 1
+                pos_b += 1
+            vertex[diag] = pos_a
+            if pos_a >= len_a and pos_b >= len_b:
+                break
+        else:
+            continue
+        break
+    else:
+        return [('-', line) for line in before] + [('+', line) for line in after]
+
+    # Walk back the path
+    script = []
+    pos_a, pos_b = len_a, len_b
+    for edits in range(len(trace) - 1, -1, -1):
+        vertex = trace[edits]
+        diag = pos_a - pos_b
+        if diag == -edits or (diag != edits and vertex.get(diag - 1, -1) < vertex.get(diag + 1, -1)):
+            prev_diag = diag + 1
+        else:
+            prev_diag = diag - 1
+        prev_a = vertex[prev_diag]
+        prev_b = prev_a - prev_diag
+        while pos_a > prev_a and pos_b > prev_b:
+            script.append((' ', before[pos_a - 1]))
+            pos_a -= 1
+            pos_b -= 1
+        if edits > 0:
+            if pos_a == prev_a:
+                script.append(('+', after[pos_b - 1]))
+            else:
+                script.append(('-', before[pos_a - 1]))
+        pos_a, pos_b = prev_a, prev_b
+    script.reverse()
+    return script
+
+
+def diff_lines(before, after, max_edits=DIFF_MAX_EDITS):
+    '''
+    Line edit script between two lists of lines. Common leading and trailing lines
+    are matched first, then lines which are unique in both lists are used as anchors
+    (patience diff) and only the blocks in between are diffed by myers_diff().
+    This keeps the diff of large documents with few changes close to linear.
+
+    Args:
+      before (list):    Lines before
+      after (list):     Lines after
+      max_edits (int):  Maximum number of edits myers_diff() searches for per block
+    Returns:
+      list:             (op, line) tuples with op being ' ' (equal), '-' (removed) or '+' (added)
+    '''
+    # Match common prefix and suffix
+    start = 0
+    while start < len(before) and start < len(after) and before[start] == after[start]:
+        start += 1
+    end_a, end_b = len(before), len(after)
+    while end_a > start and end_b > start and before[end_a - 1] == after[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    head = [(' ', line) for line in before[:start]]
+    tail = [(' ', line) for line in before[end_a:]]
+    lines_a, lines_b = before[start:end_a], after[start:end_b]
+    if not lines_a or not lines_b:
+        return head + [('-', line) for line in lines_a] + [('+', line) for line in lines_b] + tail
+
+    # Diff the blocks between unique common lines
+    anchors = common_anchors(lines_a, lines_b)
+    if not anchors:
+        return head + myers_diff(lines_a, lines_b, max_edits) + tail
+    script = []
+    pos_a = pos_b = 0
+    for idx_a, idx_b in anchors + [(len(lines_a), len(lines_b))]:
+        script.extend(diff_lines(lines_a[pos_a:idx_a], lines_b[pos_b:idx_b], max_edits))
+        if idx_a < len(lines_a):
+            script.append((' ', lines_a[idx_a]))
+        pos_a, pos_b = idx_a + 1, idx_b + 1
+    return head + script + tail
+
+
+def unified_diff(before, after, before_header, after_header, context=3, max_lines=0):
+    '''
+    Unified diff of two strings (as produced by 'diff -u').
+
+    Args:
+      before (str):         Text before
+      after (str):          Text after
+      before_header (str):  Header of the before text ('--- ' line)
+      after_header (str):   Header of the after text ('+++ ' line)
+      context (int):        Number of context lines around each change
+      max_lines (int):      Maximum number of hunk lines to return (0: unlimited)
+    Returns:
+      tuple:                (diff, added lines, removed lines)
+    '''
+    script = diff_lines(before.splitlines(), after.splitlines())
+    changes = [idx for idx, (op, _) in enumerate(script) if op != ' ']
+    added = sum(1 for op, _ in script if op == '+')
+    removed = len(changes) - added
+    if not changes:
+        return '', 0, 0
+
+    def line_range(start, length):
+        '''Hunk range in the 'start,length' notation of diff -u'''
+        if length == 1:
+            return '%d' % (start + 1)
+        return '%d,%d' % (start + 1 if length else start, length)
+
+    # Group changes, which are less than two contexts apart, into hunks
+    groups = [[changes[0], changes[0]]]
+    for idx in changes[1:]:
+        if idx - groups[-1][1] - 1 > 2 * context:
+            groups.append([idx, idx])
+        else:
+            groups[-1][1] = idx
+
+    # Line numbers of both texts at every position of the edit script
+    numbers = []
+    pos_a = pos_b = 0
+    for op, _ in script:
+        numbers.append((pos_a, pos_b))
+        pos_a += op != '+'
+        pos_b += op != '-'
+
+    lines = []
+    for first, last in groups:
+        first, last = max(first - context, 0), min(last + context + 1, len(script))
+        hunk = script[first:last]
+        lines.append('@@ -%s +%s @@' % (
+            line_range(numbers[first][0], sum(1 for op, _ in hunk if op != '+')),
+            line_range(numbers[first][1], sum(1 for op, _ in hunk if op != '-'))
+        ))
+        lines.extend(op + line for op, line in hunk)
+
+    if max_lines and len(lines) > max_lines:
+        lines = lines[:max_lines] + ['... (%d more lines)' % (len(lines) - max_lines)]
+    diff = '--- %s\n+++ %s\n%s\n' % (before_header, after_header, '\n'.join(lines))
+    return diff, added, removed
+
+
 def is_str(var):
     '''Test if a variable is a string'''
     # Check if string (lenient for byte-strings on Py2):
@@ -394,64 +1988,46 @@ def is_str(var):
     return False
 
 
-def shell_exec(command):
-    '''
-    Execute raw shell command and return exit code and output
-    '''
-    # Get absolute path of bash
-    bash = os.popen('command -v bash').read().rstrip('\r\n')
-    cpt = subprocess.Popen(
-        command,
-        executable=bash,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-    # Wait until process terminates (without using p.wait())
-    while cpt.poll() is None:
-        # Process hasn't exited yet, let's wait some more time
-        time.sleep(0.1)
-
-    # Get stdout, stderr and return code
-    stdout, stderr = cpt.communicate()
-    return_code = cpt.returncode
-
-    return return_code, stdout, stderr
-
-
 ################################################################################
 # Ansible: Module functions
 ################################################################################
 
-def eval_input(direction, module):
+def fetch_input(direction, params):
     '''
     Retrieve source or target input from file, command or string.
     Args:
       direction (str):   'source' or 'target'.
-      module (dict):     Ansible module dictionary
-                         the provided keys and sends them to a recursive delete function.
+      params (dict):     Module parameters or a single batch entry
     Returns:
-      str:               'source' or 'taget' input
+      str|CommandOutput: 'source' or 'taget' input
+    Raises:
+      YdiffError:        If the command failed or timed out
     '''
     # Get 'source' or 'target' and 'source_type' or 'target_type'
     input_data_name = direction
     input_type_name = direction + '_type'
     # Get input from Ansible module call
-    input_data = module.params.get(input_data_name)
-    input_type = module.params.get(input_type_name)
+    input_data = params.get(input_data_name)
+    input_type = params.get(input_type_name)
 
     # Input is a file
     if input_type == 'file':
-        with open(input_data, 'rt') as fpt:
+        with open(input_data, 'rb') as fpt:
             input_data = fpt.read().decode('UTF-8')
-    # Input is a command
+    # Input is a command: its output is spooled and only loaded by the diff (one entry at a time)
     elif input_type == 'command':
         command = input_data
-        ret, input_data, stderr = shell_exec(command)
+        try:
+            ret, input_data, stderr = stream_exec(
+                command,
+                lambda stdout: CommandOutput(stdout, params.get('max_document_size')),
+                params.get('command_timeout')
+            )
+        except CommandTimeout as err:
+            raise YdiffError('%s %s' % (input_data_name, err))
         if ret != 0:
-            module.fail_json(msg='%s command failed: %s' % (input_data_name, stderr))
-    # Input is string
+            raise YdiffError('%s command failed: %s' % (input_data_name, to_native(stderr)))
+    # Input is string (or the kubectl command for prefetch_targets())
     else:
         pass
 
@@ -459,12 +2035,383 @@ def eval_input(direction, module):
     return input_data
 
 
-def assert_type_command(module):
+def eval_input(direction, params, module):
+    '''
+    Retrieve source or target input and fail the module if that is not possible.
+    '''
+    try:
+        return fetch_input(direction, params)
+    except YdiffError as err:
+        module.fail_json(msg=str(err))
+
+
+def fetch_entry(params, timings=None):
+    '''
+    Retrieve source and target input of a batch entry.
+    '''
+    inputs = []
+    for direction in ('source', 'target'):
+        start = TIMER()
+        inputs.append(fetch_input(direction, params))
+        if timings is not None:
+            timings.add('fetch_' + direction, TIMER() - start)
+    return tuple(inputs)
+
+
+def prefetch_targets(ydiff, entries, inputs, concurrency, timings=None, kubectl_proxy=False, by_name=False,
+                     cache=None):
+    '''
+    Read out the deployed counterparts of all entries with target_type 'kubectl'.
+    The objects of all entries are grouped by kubectl command (context), namespace
+    and kind and every group is fetched by a single list call (by_name: a single get of
+    only the wanted objects by their names). With kubectl_proxy, a single 'kubectl proxy'
+    per command serves all calls of its groups over keep-alive connections and is
+    terminated once all groups are fetched. With a cache, every group is revalidated by
+    a metadata-only read of the resourceVersions first and only the objects which changed
+    since they were cached are read out in full (by their names).
+
+    Args:
+      ydiff (YdiffDict):     YdiffDict instance (raising YdiffError)
+      entries (list):        Module parameters or batch entries
+      inputs (list):         ((source, target), error) tuples as returned by run_pool()
+      concurrency (int):     Maximum number of concurrent list calls
+      timings (list):        Timings of the entries ('fetch_target' of all list calls an entry uses)
+      kubectl_proxy (bool):  List the objects through one 'kubectl proxy' per command
+      by_name (bool):        Only get the objects of the entries (instead of all objects of their kinds)
+      cache (LiveCache):     Cache of the normalized deployed objects of previous runs (None: disabled)
+    Returns:
+      list:                  inputs with the target of 'kubectl' entries replaced by the list of
+                             deployed objects (objects which are not deployed are left out)
+    '''
+    # Group the objects of all entries (timeout and document size limit of the first entry per group)
+    groups = OrderedDict()
+    wanted = []
+    for idx, (entry, (data, error)) in enumerate(zip(entries, inputs)):
+        objects = None
+        if error is None and entry.get('target_type') == 'kubectl':
+            objects = []
+            try:
+                for doc in ydiff.yaml2docs(data[0]):
+                    ident = identity(doc)
+                    if ident is None:
+                        raise YdiffError('target_type kubectl requires Kubernetes objects as source')
+                    api_version, kind, namespace, name = ident
+                    key = (data[1], namespace, api_version, kind)
+                    group = groups.setdefault(key, dict(
+                        timeout=entry.get('command_timeout'),
+                        max_document_size=entry.get('max_document_size'),
+                        names=OrderedDict()
+                    ))
+                    group['names'][name] = True
+                    objects.append((key, name))
+            except YdiffError as err:
+                inputs[idx] = (None, err)
+                objects = None
+        wanted.append(objects)
+
+    def kubectl_get(key, names, output, consume):
+        '''Get all (names None) or only the given objects of a group with kubectl'''
+        command, namespace, api_version, kind = key
+        command = '%s get %s' % (command, quote(kubectl_resource(api_version, kind)))
+        if names is not None:
+            command += ' %s --ignore-not-found' % (' '.join(quote(name) for name in names))
+        command += ' -o %s' % (output)
+        if namespace:
+            command += ' --namespace %s' % (quote(namespace))
+        try:
+            ret, stdout, stderr = stream_exec(command, consume, groups[key]['timeout'])
+        except CommandTimeout as err:
+            raise YdiffError('target %s' % (err))
+        if ret != 0:
+            raise YdiffError('target command failed: %s' % (to_native(stderr)))
+        return stdout
+
+    def proxy_of(key):
+        '''Return the proxy of a group (None without kubectl_proxy)'''
+        if proxies is None:
+            return None
+        proxy, error = proxies[key[0]]
+        if error is not None:
+            raise error
+        return proxy
+
+    def read_objects(key, names):
+        '''Read out all (names None) or only the given objects of a group as normalized documents'''
+        proxy = proxy_of(key)
+        if proxy is not None:
+            docs = proxy.list(key[2], key[3], key[1], names)
+        else:
+            max_document_size = groups[key]['max_document_size']
+            docs = kubectl_get(key, names, 'yaml', lambda stdout: CommandOutput(stdout, max_document_size))
+        return ydiff.yaml2docs(docs)
+
+    def read_versions(key, names):
+        '''Read out the resourceVersion of all (names None) or only the given objects of a group by name'''
+        proxy = proxy_of(key)
+        if proxy is not None:
+            return proxy.versions(key[2], key[3], key[1], names)
+        stdout = kubectl_get(
+            key, names, 'custom-columns=NAME:.metadata.name,VERSION:.metadata.resourceVersion --no-headers',
+            lambda stdout: stdout.read()
+        )
+        return dict(line.split()[:2] for line in to_native(stdout).splitlines() if len(line.split()) >= 2)
+
+    def revalidate(key):
+        '''Take the unchanged objects of a group from the cache and only read out the others'''
+        names = list(groups[key]['names'])
+        versions = read_versions(key, names if by_name else None)
+        docs = []
+        stale = []
+        for name in names:
+            ident = (key[2], key[3], key[1], name)
+            if name not in versions:
+                cache.remove(key[0], ident)
+                continue
+            doc = cache.get(key[0], ident, versions[name])
+            if doc is None:
+                stale.append(name)
+            else:
+                docs.append(doc)
+        if stale:
+            for doc in read_objects(key, stale):
+                ident = identity(doc)
+                if ident is not None:
+                    version = doc['metadata'].get('resourceVersion')
+                    cache.set(key[0], (key[2], key[3], key[1], ident[3]), version, doc)
+                docs.append(doc)
+        return docs
+
+    def fetch_group(key):
+        '''Read out all (or only the wanted) objects of a group and index them by name'''
+        start = TIMER()
+        try:
+            if cache is not None:
+                docs = revalidate(key)
+            else:
+                docs = read_objects(key, list(groups[key]['names']) if by_name else None)
+        finally:
+            durations[key] = TIMER() - start
+        index = dict()
+        for doc in docs:
+            ident = identity(doc)
+            if ident is not None:
+                index[ident[3]] = doc
+        return index
+
+    def start_proxy(command):
+        '''Start the proxy of a kubectl command'''
+        proxy = KubectlProxy(command, commands[command])
+        started.append(proxy)
+        proxy.start()
+        return proxy
+
+    durations = dict()
+    proxies = None
+    started = []
+    try:
+        if kubectl_proxy:
+            commands = OrderedDict()
+            for key, group in groups.items():
+                commands.setdefault(key[0], group['timeout'])
+            proxies = dict(zip(commands, run_pool(start_proxy, list(commands), concurrency)))
+        fetched = dict(zip(groups, run_pool(fetch_group, list(groups), concurrency)))
+    finally:
+        for proxy in started:
+            proxy.stop()
+
+    # Look up the deployed objects of each entry
+    results = []
+    for idx, ((data, error), objects) in enumerate(zip(inputs, wanted)):
+        if objects is not None:
+            if timings is not None:
+                for key in set(key for key, _ in objects):
+                    timings[idx].add('fetch_target', durations.get(key, 0.0))
+            target = []
+            for key, name in objects:
+                index, group_error = fetched[key]
+                if group_error is not None:
+                    error = group_error
+                    break
+                if name in index:
+                    target.append(index[name])
+            data = (data[0], target)
+        results.append((data, error))
+    return results
+
+
+def open_cache(params, entries):
+    '''
+    Load the cache of deployed objects (if cache_file is set) and invalidate the contexts
+    of all entries with target_type 'kubectl' if cache_flush is set.
+    Args:
+      params (dict):     Module parameters
+      entries (list):    Module parameters or batch entries
+    Returns:
+      LiveCache|None:    Cache or None if disabled
+    '''
+    if not params.get('cache_file'):
+        return None
+    cache = LiveCache(params.get('cache_file'), params.get('cache_size'))
+    if params.get('cache_flush'):
+        for entry in entries:
+            if entry.get('target_type') == 'kubectl':
+                cache.flush(entry.get('target'))
+    return cache
+
+
+def save_cache(cache, module):
+    '''
+    Write the cache of deployed objects and fail the module if that is not possible.
+    '''
+    try:
+        cache.save()
+    except (IOError, OSError) as err:
+        module.fail_json(msg='Unable to write cache_file: %s' % (to_native(err)))
+
+
+def eval_object(ydiff, source, target, name, params, module, timings):
+    '''
+    Diff a single pair of normalized source and target documents.
+    Args:
+      ydiff (YdiffDict):   YdiffDict instance
+      source (any|None):   Normalized source document (None if it only exists in target)
+      target (any|None):   Normalized target document (None if it only exists in source)
+      name (str|None):     Label used in the diff headers
+      params (dict):       Module parameters or a single batch entry
+      module (dict):       Ansible module dictionary
+      timings (Timings):   Timings of the entry
+    Returns:
+      dict:                Result with 'changed', 'changes', the object identity and (in diff mode) 'diff'
+    '''
+    result = dict()
+    ident = identity(source if source is not None else target)
+    if ident is not None:
+        result.update(dict(zip(('apiVersion', 'kind', 'namespace', 'name'), ident)))
+        name = '%s: %s' % (name, identity_name(ident)) if name else identity_name(ident)
+
+    # Compare the normalized trees directly
+    kind = result.get('kind')
+    start = TIMER()
+    if target is None:
+        result['changes'] = [{'op': 'add', 'path': ''}]
+    elif source is None:
+        result['changes'] = [{'op': 'remove', 'path': ''}]
+    else:
+        result['changes'] = ydiff.compare(source, target)
+    result['changed'] = bool(result['changes'])
+    timings.add('compare', TIMER() - start, kind)
+
+    # Ansible diff output (only serialized when --diff was requested)
+    if module._diff:
+        start = TIMER()
+        diff = {
+            'before': ydiff.dict2yaml(target) if target is not None else '',
+            'after': ydiff.dict2yaml(source) if source is not None else '',
+        }
+        if name:
+            diff['before_header'] = '%s (%s)' % (
+                name, 'deployed' if target is not None else 'not deployed'
+            )
+            diff['after_header'] = '%s (local)' % (name)
+        timings.add('dump', TIMER() - start, kind)
+
+        # Unified diff computed by the module (only the hunks are returned)
+        if params.get('diff_format') == 'unified':
+            start = TIMER()
+            prepared, added, removed = unified_diff(
+                diff['before'],
+                diff['after'],
+                'before: %s' % (diff['before_header']) if name else 'before',
+                'after: %s' % (diff['after_header']) if name else 'after',
+                params.get('diff_context'),
+                params.get('diff_max_lines')
+            )
+            diff = {'prepared': prepared}
+            result['stats'] = dict(added=added, removed=removed, paths=len(result['changes']))
+            timings.add('diff', TIMER() - start, kind)
+        result['diff'] = diff
+
+    return result
+
+
+def compile_ignore_profiles(entries):
+    '''
+    Build the IgnoreProfiles of all entries. Entries with equal profiles and ignore keys
+    share one instance, so that each kind is only merged and compiled once per module call.
+    Args:
+      entries (list):  Module parameters or batch entries
+    Returns:
+      list:            IgnoreProfiles in the order of entries
+    '''
+    compiled = []
+    result = []
+    for params in entries:
+        key = (params.get('diff_ignore_profiles'), params.get('diff_ignore_keys'))
+        for other, ignore_keys in compiled:
+            if other == key:
+                break
+        else:
+            ignore_keys = IgnoreProfiles(*key)
+            compiled.append((key, ignore_keys))
+        result.append(ignore_keys)
+    return result
+
+
+def eval_diff(ydiff, source, target, ignore_keys, params, module, timings=None):
+    '''
+    Diff the source against the target of a single call or batch entry.
+    Both may contain multiple documents, which are diffed per object.
+    Args:
+      ydiff (YdiffDict):             YdiffDict instance
+      source (str):                  Source input (local template to deploy)
+      target (str):                  Target input (currently deployed)
+      ignore_keys (IgnoreProfiles):  Compiled ignore profiles of the entry
+      params (dict):                 Module parameters or a single batch entry
+      module (dict):                 Ansible module dictionary
+      timings (Timings|None):        Timings of the entry (already containing the fetch phases)
+    Returns:
+      dict:                          Result with 'changed', 'objects', (in diff mode) 'diff'
+                                     and (if requested) 'timings' keys
+    '''
+    if timings is None:
+        timings = Timings()
+    timings.size('source', source)
+    timings.size('target', target)
+    ignore_empty = params.get('diff_ignore_empty')
+
+    # Convert to normalized documents and remove ignored (and empty) keys in one go
+    # TODO: Only remove keys from target, if they are not set in source
+    # This will allow for complete diffs, when no target exists yet.
+    digest_size = params.get('diff_digest_size')
+    digest_secrets = params.get('diff_digest_secrets')
+    source = ydiff.yaml2docs(source, ignore_keys, False, digest_size, digest_secrets, timings)
+    target = ydiff.yaml2docs(target, ignore_keys, ignore_empty, digest_size, digest_secrets, timings)
+
+    # Diff each object against its counterpart
+    objects = [
+        eval_object(ydiff, src, tgt, params.get('name'), params, module, timings)
+        for src, tgt in match_documents(source, target)
+    ]
+
+    result = dict(
+        changed=any(obj['changed'] for obj in objects),
+        objects=objects
+    )
+    if module._diff:
+        diffs = [obj.pop('diff') for obj in objects]
+        result['diff'] = diffs[0] if len(diffs) == 1 else diffs
+    if params.get('timings'):
+        result['timings'] = timings.result()
+
+    return result
+
+
+def assert_type_command(params, module):
     '''
     Assert conditions if (source|target)_type is 'command'
     '''
     # Validate source
-    if module.params.get('source_type') == 'command':
+    if params.get('source_type') == 'command':
         if module.check_mode:
             result = dict(
                 changed=False,
@@ -474,7 +2421,7 @@ def assert_type_command(module):
             module.exit_json(**result)
 
     # Validate target
-    if module.params.get('target_type') == 'command':
+    if params.get('target_type') == 'command':
         if module.check_mode:
             result = dict(
                 changed=False,
@@ -484,15 +2431,15 @@ def assert_type_command(module):
             module.exit_json(**result)
 
 
-def assert_type_file(module):
+def assert_type_file(params, module):
     '''
     Assert conditions if (source|target)_type is 'file'
     '''
-    source = module.params.get('source')
-    target = module.params.get('target')
+    source = params.get('source')
+    target = params.get('target')
 
     # Validate source
-    if module.params.get('source_type') == 'file':
+    if params.get('source_type') == 'file':
         b_source = to_bytes(source, errors='surrogate_or_strict')
         if not os.path.exists(b_source):
             module.fail_json(msg='source %s not found' % (source))
@@ -504,7 +2451,7 @@ def assert_type_file(module):
             )
 
     # Validate target
-    if module.params.get('target_type') == 'file':
+    if params.get('target_type') == 'file':
         b_target = to_bytes(target, errors='surrogate_or_strict')
         if not os.path.exists(b_target):
             module.fail_json(msg='target %s not found' % (target))
@@ -515,12 +2462,12 @@ def assert_type_file(module):
                 msg='ydiff does not support recursive diff of directory: %s' % (target)
             )
 
-def assert_ignore_keys(module):
+def assert_ignore_keys(params, module):
     '''
     Assert that diff_ignore_keys is correct yaml.
     If not, its contents will be of type string, otherwise a correct dictionary is returned.
     '''
-    ignore_keys = module.params.get('diff_ignore_keys')
+    ignore_keys = params.get('diff_ignore_keys')
 
     if is_str(ignore_keys):
         module.fail_json(msg='Invalid yaml for diff_ignore_keys')
@@ -530,43 +2477,215 @@ def assert_ignore_keys(module):
         module.fail_json(msg='Invalid yaml for diff_ignore_keys')
 
 
+def assert_batch(module):
+    '''
+    Assert that each batch entry is a dictionary with a source and target
+    and return the entries with module-level defaults applied.
+    '''
+    entries = []
+    for idx, entry in enumerate(module.params.get('batch')):
+        if not isinstance(entry, dict):
+            module.fail_json(msg='batch entry %d is not a dictionary' % (idx))
+        for key in ('source', 'target'):
+            if entry.get(key) is None:
+                module.fail_json(msg='batch entry %d is missing %s' % (idx, key))
+        for key, choices in (('source_type', ('string', 'file', 'command')),
+                             ('target_type', ('string', 'file', 'command', 'kubectl'))):
+            if entry.get(key, 'string') not in choices:
+                module.fail_json(msg='batch entry %d has invalid %s: %s' % (idx, key, entry[key]))
+
+        # Apply module-level values for anything not set per entry
+        params = dict(
+            (key, module.params.get(key))
+            for key in ('source_type', 'target_type', 'diff_ignore_keys', 'diff_ignore_profiles',
+                        'diff_ignore_empty', 'diff_digest_size', 'diff_digest_secrets', 'diff_format',
+                        'diff_context', 'diff_max_lines', 'command_timeout', 'max_document_size', 'timings')
+        )
+        params.update(entry)
+        entries.append(params)
+    return entries
+
+
 
 ################################################################################
 # Ansible: Initialize module
 ################################################################################
 
+# Module arguments (shared with the ydiff action plugin)
+ARGUMENT_SPEC = dict(
+    source=dict(type='str', required=False, default=None),
+    target=dict(type='str', required=False, default=None),
+    source_type=dict(
+        type='str',
+        required=False,
+        default='string',
+        choices=['string', 'file', 'command']
+    ),
+    target_type=dict(
+        type='str',
+        required=False,
+        default='string',
+        choices=['string', 'file', 'command', 'kubectl']
+    ),
+    diff_ignore_keys=dict(
+        type='dict',
+        required=False,
+        default={},
+    ),
+    diff_ignore_profiles=dict(
+        type='dict',
+        required=False,
+        default={},
+    ),
+    diff_ignore_empty=dict(
+        type='bool',
+        required=False,
+        default=False,
+    ),
+    diff_digest_size=dict(
+        type='int',
+        required=False,
+        default=0,
+    ),
+    diff_digest_secrets=dict(
+        type='bool',
+        required=False,
+        default=True,
+    ),
+    diff_format=dict(
+        type='str',
+        required=False,
+        default='full',
+        choices=['full', 'unified']
+    ),
+    diff_context=dict(
+        type='int',
+        required=False,
+        default=3,
+    ),
+    diff_max_lines=dict(
+        type='int',
+        required=False,
+        default=0,
+    ),
+    batch=dict(
+        type='list',
+        required=False,
+        default=None,
+    ),
+    command_timeout=dict(
+        type='int',
+        required=False,
+        default=0,
+    ),
+    max_document_size=dict(
+        type='int',
+        required=False,
+        default=0,
+    ),
+    concurrency=dict(
+        type='int',
+        required=False,
+        default=1,
+    ),
+    timings=dict(
+        type='bool',
+        required=False,
+        default=False,
+    ),
+    memory_stats=dict(
+        type='bool',
+        required=False,
+        default=False,
+    ),
+    kubectl_fetch=dict(
+        type='str',
+        required=False,
+        default='list',
+        choices=['list', 'name']
+    ),
+    kubectl_proxy=dict(
+        type='bool',
+        required=False,
+        default=False,
+    ),
+    state_file=dict(
+        type='path',
+        required=False,
+        default=None,
+    ),
+    state_full=dict(
+        type='bool',
+        required=False,
+        default=False,
+    ),
+    cache_file=dict(
+        type='path',
+        required=False,
+        default=None,
+    ),
+    cache_size=dict(
+        type='int',
+        required=False,
+        default=64 * 1024 * 1024,
+    ),
+    cache_flush=dict(
+        type='bool',
+        required=False,
+        default=False,
+    )
+)
+
+# Constraints between module arguments (shared with the ydiff action plugin)
+ARGUMENT_CONSTRAINTS = dict(
+    required_one_of=[['source', 'batch']],
+    required_together=[['source', 'target']],
+    mutually_exclusive=[['source', 'batch'], ['target', 'batch']],
+)
+
+
+class ModuleExit(Exception):
+    '''
+    Raised by ModuleProxy.exit_json() and ModuleProxy.fail_json() to end a module run.
+    '''
+    def __init__(self, result):
+        super(ModuleExit, self).__init__(result.get('msg'))
+        self.result = result
+
+
+class ModuleProxy(object):
+    '''
+    Minimal AnsibleModule replacement to run ydiff in-process on the controller
+    (used by the ydiff action plugin). Arguments must already be validated
+    against ARGUMENT_SPEC. Exiting raises ModuleExit with the result.
+    '''
+    def __init__(self, params, check_mode=False, diff=False):
+        self.params = params
+        self.check_mode = check_mode
+        self._diff = diff
+
+    def exit_json(self, **kwargs):
+        '''
+        End the module run successfully.
+        '''
+        raise ModuleExit(kwargs)
+
+    def fail_json(self, **kwargs):
+        '''
+        End the module run with a failure.
+        '''
+        kwargs['failed'] = True
+        raise ModuleExit(kwargs)
+
+
 def init_ansible_module():
     '''
     Initialize Ansible Module.
     '''
     return AnsibleModule(
-        argument_spec=dict(
-            source=dict(type='str', required=True, default=None),
-            target=dict(type='str', required=True, default=None),
-            source_type=dict(
-                type='str',
-                required=False,
-                default='string',
-                choices=['string', 'file', 'command']
-            ),
-            target_type=dict(
-                type='str',
-                required=False,
-                default='string',
-                choices=['string', 'file', 'command']
-            ),
-            diff_ignore_keys=dict(
-                type='dict',
-                required=False,
-                default={},
-            ),
-            diff_ignore_empty=dict(
-                type='bool',
-                required=False,
-                default=False,
-            )
-        ),
-        supports_check_mode=True
+        argument_spec=ARGUMENT_SPEC,
+        supports_check_mode=True,
+        **ARGUMENT_CONSTRAINTS
     )
 
 
@@ -574,62 +2693,177 @@ def init_ansible_module():
 # Main entry point
 ################################################################################
 
-def main():
+def run_module(module):
     '''
-    Main entry point
+    Run ydiff for an initialized module and exit it with the result.
+    Args:
+      module (AnsibleModule|ModuleProxy):  Ansible module (or in-process replacement)
     '''
-    # Initialize module
-    module = init_ansible_module()
-    ydiff = YdiffDict(module.fail_json, 'msg')
-
-    # Assert module input
-    assert_type_command(module)
-    assert_type_file(module)
-    assert_ignore_keys(module)
+    memory = MemoryTrace(module.params.get('memory_stats'))
+    try:
+        run_diff(module, memory)
+    finally:
+        memory.stop()
 
-    # Retrieve module inputs
-    source = eval_input('source', module) # local template to deploy
-    target = eval_input('target', module) # Currently deployed
-    ignore_keys = module.params.get('diff_ignore_keys')
-    ignore_empty = module.params.get('diff_ignore_empty')
 
-    # Convert to normalized dicts
-    ignore_keys = ydiff.yaml2dict(ignore_keys)
-    source = ydiff.yaml2dict(source)
-    target = ydiff.yaml2dict(target)
+def run_diff(module, memory):
+    '''
+    Run the single or batch diff and exit the module with the result.
+    Args:
+      module (AnsibleModule|ModuleProxy):  Ansible module (or in-process replacement)
+      memory (MemoryTrace):                Memory trace of the run
+    '''
+    ydiff = YdiffDict(module.fail_json, 'msg')
 
-    # Remove ignored keys
-    # TODO: Only remove keys from target, if they are not set in source
-    # This will allow for complete diffs, when no target exists yet.
-    source = ydiff.del_ignore_keys(source, ignore_keys)
-    target = ydiff.del_ignore_keys(target, ignore_keys)
-
-    # Remove empty yaml keys
-    if ignore_empty:
-        #source = ydiff.del_empty_keys(source)
-        target = ydiff.del_empty_keys(target)
-
-    # Convert back to string
-    source = ydiff.dict2yaml(source)
-    target = ydiff.dict2yaml(target)
-
-    # Ansible diff output
-    diff = {
-        'before': target,
-        'after': source,
-    }
-    # Did we have any changes?
-    changed = (source != target)
+    # Single diff
+    if module.params.get('batch') is None:
+        # Assert module input
+        assert_type_command(module.params, module)
+        assert_type_file(module.params, module)
+        assert_ignore_keys(module.params, module)
+
+        # Retrieve module inputs
+        timings = Timings()
+        start = TIMER()
+        source = eval_input('source', module.params, module) # local template to deploy
+        timings.add('fetch_source', TIMER() - start)
+        start = TIMER()
+        target = eval_input('target', module.params, module) # Currently deployed
+        timings.add('fetch_target', TIMER() - start)
+        cache = None
+        if module.params.get('target_type') == 'kubectl':
+            cache = open_cache(module.params, [module.params])
+            inputs = prefetch_targets(
+                YdiffDict(ydiff_error), [module.params], [((source, target), None)], 1, [timings],
+                module.params.get('kubectl_proxy'), module.params.get('kubectl_fetch') == 'name', cache
+            )
+            if cache is not None:
+                save_cache(cache, module)
+            data, error = inputs[0]
+            if error is not None:
+                module.fail_json(msg=to_native(error))
+            source, target = data
+
+        # Exit ansible module call
+        ignore_keys = compile_ignore_profiles([module.params])[0]
+        result = eval_diff(ydiff, source, target, ignore_keys, module.params, module, timings)
+        result['yaml_backend'] = YAML_BACKEND
+        if cache is not None:
+            result['cache_stats'] = cache.stats()
+        if module.params.get('memory_stats'):
+            result['memory'] = memory.result()
+        module.exit_json(**result)
+
+    # Batch diff: assert all entries before doing any work
+    entries = assert_batch(module)
+    for entry in entries:
+        assert_type_command(entry, module)
+        assert_type_file(entry, module)
+        assert_ignore_keys(entry, module)
+
+    # Retrieve all inputs concurrently (errors only fail their own entry)
+    ydiff = YdiffDict(ydiff_error)
+    timings = [Timings() for _ in entries]
+    inputs = run_pool(
+        lambda idx: fetch_entry(entries[idx], timings[idx]),
+        list(range(len(entries))),
+        module.params.get('concurrency')
+    )
+    cache = open_cache(module.params, entries)
+    inputs = prefetch_targets(
+        ydiff, entries, inputs, module.params.get('concurrency'), timings,
+        module.params.get('kubectl_proxy'), module.params.get('kubectl_fetch') == 'name', cache
+    )
+    if cache is not None:
+        save_cache(cache, module)
+
+    # Incremental mode: entries which converged in a previous run and whose source and
+    # deployed objects are unchanged since then are not diffed again
+    store = None
+    if module.params.get('state_file'):
+        store = StateStore(module.params.get('state_file'))
+
+    results = []
+    profiles = compile_ignore_profiles(entries)
+    for idx, (entry, ignore_keys, entry_timings) in enumerate(zip(entries, profiles, timings)):
+        # Release the inputs of every entry once it is diffed
+        data, error = inputs[idx]
+        inputs[idx] = None
+        key = entry.get('state_key') or entry.get('name')
+        state = None
+        if error is None:
+            if store is not None and key is not None:
+                state = dict(source=fingerprint(data[0], entry), target=fingerprint(data[1]))
+            stored = store.get(key) if state is not None else None
+            if stored and not module.params.get('state_full') and \
+                    (stored.get('source'), stored.get('target')) == (state['source'], state['target']):
+                result = dict(
+                    changed=False,
+                    cached=True,
+                    objects=[
+                        dict(zip(('apiVersion', 'kind', 'namespace', 'name'), ident), changed=False, changes=[])
+                        for ident in stored.get('objects', [])
+                    ]
+                )
+                if entry.get('timings'):
+                    result['timings'] = entry_timings.result()
+            else:
+                try:
+                    result = eval_diff(ydiff, data[0], data[1], ignore_keys, entry, module, entry_timings)
+                except YdiffError as err:
+                    error = err
+        if error is not None:
+            result = dict(changed=False, failed=True, msg=to_native(error))
+        result['name'] = entry.get('name')
+        results.append(result)
+
+        # Only converged entries are stored (with the identities of their Kubernetes objects)
+        if state is not None and not result['changed'] and not result.get('failed'):
+            state['objects'] = [
+                [obj['apiVersion'], obj['kind'], obj['namespace'], obj['name']]
+                for obj in result['objects'] if 'kind' in obj
+            ]
+            store.set(key, state)
+        elif store is not None and key is not None:
+            store.remove(key)
+
+    if store is not None:
+        try:
+            store.save()
+        except (IOError, OSError) as err:
+            module.fail_json(msg='Unable to write state_file: %s' % (to_native(err)))
 
     # Ansible module returned variables
     result = dict(
-        diff=diff,
-        changed=changed
+        results=results,
+        diff=[
+            diff for res in results if res['changed'] and 'diff' in res
+            for diff in (res['diff'] if isinstance(res['diff'], list) else [res['diff']])
+        ],
+        changed=any(res['changed'] for res in results),
+        yaml_backend=YAML_BACKEND
     )
+    if cache is not None:
+        result['cache_stats'] = cache.stats()
+    if module.params.get('memory_stats'):
+        result['memory'] = memory.result()
 
     # Exit ansible module call
+    failed = [res for res in results if res.get('failed')]
+    if failed:
+        result['msg'] = '%d of %d batch entries failed' % (len(failed), len(results))
+        module.fail_json(**result)
     module.exit_json(**result)
 
 
+def main():
+    '''
+    Main entry point
+    '''
+    # Initialize module
+    module = init_ansible_module()
+    run_module(module)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# (c) 2017, cytopia <cytopia@everythingcli.org>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Shared helpers of the ydiff and k8s_remove modules of this role: running
+(kubectl) shell commands in their own process group with a timeout, a bounded
+worker pool and the fully qualified kubectl resource of a kind.
+'''
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type # pylint: disable=invalid-name
+
+import os
+import sys
+import signal
+import threading
+import subprocess
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Are we using Python2?
+PY2 = sys.version_info.major == 2
+
+# Absolute path of bash (resolved once by which_bash())
+BASH = None
+
+
+################################################################################
+# Helper Classes
+################################################################################
+
+class CommandTimeout(Exception):
+    '''
+    Raised by stream_exec() when a command did not finish within its timeout.
+    '''
+    def __init__(self, command, timeout):
+        super(CommandTimeout, self).__init__(
+            'command timed out after %s seconds: %s' % (timeout, command)
+        )
+        self.command = command
+        self.timeout = timeout
+
+
+################################################################################
+# Helper Functions
+################################################################################
+
+def which_bash():
+    '''
+    Return the absolute path of bash. The lookup is done only once
+    and cached for all subsequent commands.
+    '''
+    global BASH
+    if BASH is None:
+        for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+            bash = os.path.join(path, 'bash')
+            if os.path.isfile(bash) and os.access(bash, os.X_OK):
+                BASH = bash
+                break
+        else:
+            BASH = '/bin/bash'
+    return BASH
+
+
+def process_group():
+    '''
+    Return the subprocess.Popen() arguments to run a command in its own process group.
+    '''
+    if PY2:
+        return dict(preexec_fn=os.setsid)
+    return dict(start_new_session=True)
+
+
+def stream_exec(command, consume, timeout=None):
+    '''
+    Execute raw shell command and pass its stdout (file object) to consume while the
+    command runs, so that large outputs can be processed without buffering them.
+    stderr is drained concurrently. If timeout (in seconds) is given and hit, the command
+    including all of its child processes is killed and CommandTimeout is raised.
+
+    Args:
+      command (str):   Shell command to execute
+      consume (func):  Function called with the stdout file object
+      timeout (int):   Timeout in seconds (0 or None: no timeout)
+    Returns:
+      tuple:           Exit code, result of consume and stderr. If the command failed by
+                       itself, errors of consume (e.g.: its partial output) are not raised.
+    '''
+    # Run in its own process group, so that a timeout can also kill the
+    # commands spawned by bash (e.g.: kubectl)
+    cpt = subprocess.Popen(
+        command,
+        executable=which_bash(),
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **process_group()
+    )
+
+    def kill():
+        '''Kill the process group'''
+        try:
+            os.killpg(cpt.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timed_out = []
+    def expire():
+        '''Kill the process group once the timeout is hit'''
+        timed_out.append(True)
+        kill()
+
+    # Drain stderr as output arrives (large outputs cannot block on a full pipe)
+    stderr = []
+    drain = threading.Thread(target=lambda: stderr.append(cpt.stderr.read()))
+    drain.daemon = True
+    drain.start()
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, expire)
+        timer.start()
+
+    result = error = None
+    aborted = False
+    try:
+        try:
+            result = consume(cpt.stdout)
+        except Exception as err: # pylint: disable=broad-except
+            # Stop a command whose output cannot be processed any further
+            error = err
+            if cpt.poll() is None:
+                aborted = True
+                kill()
+        cpt.stdout.close()
+        ret = cpt.wait()
+        drain.join()
+        cpt.stderr.close()
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    if timed_out:
+        raise CommandTimeout(command, timeout)
+    if error is not None and (ret == 0 or aborted):
+        raise error
+
+    return ret, result, stderr[0] if stderr else b''
+
+
+def shell_exec(command, timeout=None):
+    '''
+    Execute raw shell command and return exit code and output.
+    If timeout (in seconds) is given and hit, the command including all of its
+    child processes is killed and CommandTimeout is raised.
+    '''
+    return stream_exec(command, lambda stdout: stdout.read(), timeout)
+
+
+def run_pool(func, items, concurrency):
+    '''
+    Call func for each item on a bounded pool of worker threads.
+
+    Args:
+      func (func):        Function to call with a single item
+      items (list):       Items to process
+      concurrency (int):  Maximum number of concurrent calls
+    Returns:
+      list:               (result, error) tuples in the order of items. If func raised,
+                          result is None and error the raised exception (otherwise None).
+    '''
+    results = [None] * len(items)
+    jobs = queue.Queue()
+    for idx, item in enumerate(items):
+        jobs.put((idx, item))
+
+    def worker():
+        '''Process jobs until the queue is empty'''
+        while True:
+            try:
+                idx, item = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[idx] = (func(item), None)
+            except Exception as err: # pylint: disable=broad-except
+                results[idx] = (None, err)
+
+    workers = min(max(concurrency or 1, 1), len(items))
+    if workers <= 1:
+        worker()
+        return results
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def kubectl_resource(api_version, kind):
+    '''
+    Fully qualified kubectl resource of a kind (e.g.: 'deployment.v1.apps'),
+    so that equally named kinds of different API groups are not mixed up.
+    '''
+    group, _, version = (api_version or '').rpartition('/')
+    if not group:
+        return kind.lower()
+    return '%s.%s.%s' % (kind.lower(), version, group)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Offline benchmark of the ydiff module with synthetic Kubernetes manifests.
+
+Generates Deployments (1 to 50 containers), ConfigMaps (1 KB to 10 MB), deeply
+nested custom resources and multi-document bundles, each as local template and
+as deployed object (with the fields Kubernetes adds). For every case it times
+the YdiffDict functions and the whole module run against the fake kubectl.
+
+Usage:
+  benchmark.py [--output <file>] [--repeat <n>] [--filter <regex>]
+  benchmark.py --compare <baseline> [--tolerance <ratio>] [--output <file>]
+
+The results are written as JSON (median and minimum seconds per case and
+operation). With --compare, every median slower than the baseline by more
+than the tolerance is reported as regression and the exit code is 1.
+'''
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import re
+import sys
+import copy
+import json
+import platform
+import argparse
+import tempfile
+import timeit
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+FAKE_KUBECTL = os.path.join(ROOT, 'tests', 'support', 'fake-kubectl.sh')
+
+# The module utils of the role are only bundled into packaged modules by Ansible
+sys.path.insert(0, os.path.join(ROOT, 'library'))
+import ansible.module_utils # pylint: disable=wrong-import-position
+ansible.module_utils.__path__.append(os.path.join(ROOT, 'module_utils'))
+import ydiff # pylint: disable=wrong-import-position
+
+
+################################################################################
+# Manifest generators
+################################################################################
+
+def server_metadata(metadata):
+    '''
+    Add the metadata fields Kubernetes sets on deployed objects.
+    '''
+    metadata = copy.deepcopy(metadata)
+    metadata.update({
+        'uid': '5c0b4a28-8d55-4f8e-9b7a-2f4c6d1e0a93',
+        'resourceVersion': '123456',
+        'generation': 3,
+        'creationTimestamp': '2020-01-01T00:00:00Z',
+        'selfLink': '/apis/%s/%s' % (metadata.get('namespace', ''), metadata['name']),
+        'managedFields': [{
+            'manager': 'kubectl',
+            'operation': 'Update',
+            'apiVersion': 'v1',
+            'time': '2020-01-01T00:00:00Z',
+            'fieldsType': 'FieldsV1',
+            'fieldsV1': {'f:metadata': {'f:labels': {'.': {}}}},
+        }],
+    })
+    return metadata
+
+
+def deployment(containers):
+    '''
+    Deployment with the given number of containers (env, ports, probes, resources).
+    '''
+    name = 'app-%d' % (containers)
+    spec = []
+    for idx in range(containers):
+        spec.append({
+            'name': 'container-%d' % (idx),
+            'image': 'registry.example.com/app/container-%d:1.0.%d' % (idx, idx),
+            'args': ['--port=%d' % (8000 + idx), '--log-level=info'],
+            'env': [{'name': 'VAR_%d' % (num), 'value': 'value-%d' % (num)} for num in range(10)],
+            'ports': [{'name': 'http', 'containerPort': 8000 + idx}],
+            'resources': {
+                'limits': {'cpu': '500m', 'memory': '256Mi'},
+                'requests': {'cpu': '100m', 'memory': '128Mi'},
+            },
+            'readinessProbe': {'httpGet': {'path': '/healthz', 'port': 8000 + idx}},
+            'volumeMounts': [{'name': 'config', 'mountPath': '/etc/app-%d' % (idx)}],
+        })
+    local = {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {'name': name, 'namespace': 'default', 'labels': {'app': name}},
+        'spec': {
+            'replicas': 2,
+            'selector': {'matchLabels': {'app': name}},
+            'template': {
+                'metadata': {'labels': {'app': name}},
+                'spec': {
+                    'containers': spec,
+                    'volumes': [{'name': 'config', 'configMap': {'name': name}}],
+                },
+            },
+        },
+    }
+    deployed = copy.deepcopy(local)
+    deployed['metadata'] = server_metadata(local['metadata'])
+    deployed['metadata']['annotations'] = {'deployment.kubernetes.io/revision': '3'}
+    deployed['spec'].update({
+        'progressDeadlineSeconds': 600,
+        'revisionHistoryLimit': 10,
+        'strategy': {'type': 'RollingUpdate', 'rollingUpdate': {'maxSurge': '25%', 'maxUnavailable': '25%'}},
+    })
+    deployed['spec']['template']['spec'].update({
+        'dnsPolicy': 'ClusterFirst',
+        'restartPolicy': 'Always',
+        'schedulerName': 'default-scheduler',
+        'securityContext': {},
+        'terminationGracePeriodSeconds': 30,
+    })
+    for container in deployed['spec']['template']['spec']['containers']:
+        container.update({
+            'imagePullPolicy': 'IfNotPresent',
+            'terminationMessagePath': '/dev/termination-log',
+            'terminationMessagePolicy': 'File',
+        })
+        container['ports'][0]['protocol'] = 'TCP'
+    # One changed value
+    deployed['spec']['template']['spec']['containers'][0]['image'] += '-old'
+    deployed['status'] = {'replicas': 2, 'readyReplicas': 2, 'observedGeneration': 3}
+    return [local], [deployed]
+
+
+def configmap(size):
+    '''
+    ConfigMap with about the given number of bytes of data (values of 1 KB).
+    '''
+    line = 'x' * 63 + '\n'
+    data = dict(('key-%d.conf' % (idx), line * 16) for idx in range(max(1, size // 1024)))
+    local = {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {'name': 'config-%d' % (size), 'namespace': 'default'},
+        'data': data,
+    }
+    deployed = copy.deepcopy(local)
+    deployed['metadata'] = server_metadata(local['metadata'])
+    deployed['data']['key-0.conf'] = line * 15
+    return [local], [deployed]
+
+
+def custom_resource(depth, width=5):
+    '''
+    Custom resource with a spec nested depth levels deep.
+    '''
+    def level(num):
+        node = dict(('field%d' % (idx), 'value-%d-%d' % (num, idx)) for idx in range(width))
+        node['items'] = [{'name': 'item-%d' % (idx), 'enabled': True} for idx in range(width)]
+        if num < depth:
+            node['nested'] = level(num + 1)
+        return node
+    local = {
+        'apiVersion': 'example.com/v1alpha1',
+        'kind': 'Widget',
+        'metadata': {'name': 'widget-%d' % (depth), 'namespace': 'default'},
+        'spec': level(1),
+    }
+    deployed = copy.deepcopy(local)
+    deployed['metadata'] = server_metadata(local['metadata'])
+    deployed['status'] = {'conditions': [{'type': 'Ready', 'status': 'True'}]}
+    return [local], [deployed]
+
+
+def bundle(count):
+    '''
+    Multi-document bundle of count Deployments with their Service and ConfigMap.
+    '''
+    local = []
+    deployed = []
+    for idx in range(count):
+        for docs_local, docs_deployed in (deployment(1 + idx % 3), configmap(2048)):
+            for doc in docs_local + docs_deployed:
+                doc['metadata']['name'] += '-%d' % (idx)
+            local.extend(docs_local)
+            deployed.extend(docs_deployed)
+        service = {
+            'apiVersion': 'v1',
+            'kind': 'Service',
+            'metadata': {'name': 'svc-%d' % (idx), 'namespace': 'default'},
+            'spec': {'selector': {'app': 'app-%d' % (idx)}, 'ports': [{'port': 80, 'targetPort': 8000}]},
+        }
+        local.append(service)
+        service = copy.deepcopy(service)
+        service['metadata'] = server_metadata(service['metadata'])
+        service['spec'].update({'clusterIP': '10.0.0.%d' % (idx % 250 + 1), 'type': 'ClusterIP'})
+        deployed.append(service)
+    return local, deployed
+
+
+CASES = [
+    ('deployment-1', lambda: deployment(1)),
+    ('deployment-10', lambda: deployment(10)),
+    ('deployment-50', lambda: deployment(50)),
+    ('configmap-1k', lambda: configmap(1024)),
+    ('configmap-100k', lambda: configmap(100 * 1024)),
+    ('configmap-1m', lambda: configmap(1024 * 1024)),
+    ('configmap-10m', lambda: configmap(10 * 1024 * 1024)),
+    ('crd-depth-10', lambda: custom_resource(10)),
+    ('crd-depth-50', lambda: custom_resource(50)),
+    ('bundle-10', lambda: bundle(10)),
+    ('bundle-50', lambda: bundle(50)),
+]
+
+
+################################################################################
+# Benchmark
+################################################################################
+
+def dump(docs):
+    '''
+    Dump documents as (multi-document) yaml string.
+    '''
+    return yaml.safe_dump_all(docs, default_flow_style=False)
+
+
+def measure(func, repeat, setup=None):
+    '''
+    Run func repeat times and return the median and minimum duration in seconds.
+    setup() is run (untimed) before every run and its return value passed to func.
+    '''
+    durations = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = timeit.default_timer()
+        func(arg)
+        durations.append(timeit.default_timer() - start)
+    durations.sort()
+    return {'median': durations[len(durations) // 2], 'min': durations[0], 'runs': repeat}
+
+
+def run_module(source, target_file, profiles):
+    '''
+    Run the whole module (single mode, in diff mode) against the fake kubectl.
+    '''
+    params = dict((key, spec.get('default')) for key, spec in ydiff.ARGUMENT_SPEC.items())
+    params.update({
+        'source': source,
+        'target': 'FAKE_KUBECTL_OBJECT=%s %s get -f template.yml -o yaml' % (target_file, FAKE_KUBECTL),
+        'source_type': 'string',
+        'target_type': 'command',
+        'diff_ignore_profiles': profiles,
+        'diff_ignore_empty': True,
+    })
+    try:
+        ydiff.run_module(ydiff.ModuleProxy(params, diff=True))
+    except ydiff.ModuleExit as err:
+        if err.result.get('failed'):
+            raise RuntimeError(err.result.get('msg'))
+
+
+def benchmark_case(name, local, deployed, profiles, repeat, tmpdir):
+    '''
+    Time all operations of a single case.
+    '''
+    ydict = ydiff.YdiffDict(ydiff.ydiff_error)
+    ignore = ydiff.IgnoreProfiles(profiles)
+    source = dump(local)
+    target = dump(deployed)
+    target_file = os.path.join(tmpdir, name + '.yml')
+    with open(target_file, 'w') as stream:
+        stream.write(target)
+
+    results = {'source_bytes': len(source), 'target_bytes': len(target), 'documents': len(local)}
+    if len(local) == 1:
+        results['yaml2dict'] = measure(lambda _: ydict.yaml2dict(target), repeat)
+    else:
+        results['yaml2docs'] = measure(lambda _: ydict.yaml2docs(target), repeat)
+    results['del_ignore_keys'] = measure(
+        lambda docs: [ydict.del_ignore_keys(doc, ignore.get(doc['kind'])) for doc in docs],
+        repeat,
+        lambda: copy.deepcopy(deployed)
+    )
+    results['del_empty_keys'] = measure(
+        lambda docs: [ydict.del_empty_keys(doc) for doc in docs],
+        repeat,
+        lambda: copy.deepcopy(deployed)
+    )
+    results['dict2yaml'] = measure(lambda _: [ydict.dict2yaml(doc) for doc in deployed], repeat)
+    results['run_module'] = measure(lambda _: run_module(source, target_file, profiles), repeat)
+    return results
+
+
+def benchmark(repeat, pattern):
+    '''
+    Run all (matching) cases.
+    '''
+    with open(os.path.join(ROOT, 'vars', 'main.yml')) as stream:
+        profiles = yaml.safe_load(stream)['k8s_diff_ignore_keys']
+
+    tmpdir = tempfile.mkdtemp(prefix='ydiff-benchmark-')
+    cases = {}
+    try:
+        for name, generate in CASES:
+            if pattern and not re.search(pattern, name):
+                continue
+            local, deployed = generate()
+            cases[name] = benchmark_case(name, local, deployed, profiles, repeat, tmpdir)
+            print('%-16s %s' % (name, '  '.join(
+                '%s=%.4fs' % (oper, res['median']) for oper, res in sorted(cases[name].items())
+                if isinstance(res, dict)
+            )))
+    finally:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'yaml_backend': ydiff.YAML_BACKEND,
+            'repeat': repeat,
+        },
+        'cases': cases,
+    }
+
+
+def compare(current, baseline, tolerance):
+    '''
+    Compare the medians with the baseline and return the regressions.
+    '''
+    regressions = []
+    for name, operations in sorted(current['cases'].items()):
+        for oper, res in sorted(operations.items()):
+            if not isinstance(res, dict):
+                continue
+            base = baseline.get('cases', {}).get(name, {}).get(oper)
+            if not isinstance(base, dict) or not base['median']:
+                continue
+            ratio = res['median'] / base['median']
+            status = 'REGRESSION' if ratio > 1 + tolerance else 'ok'
+            print('%-16s %-16s %10.4fs %10.4fs %7.2fx  %s' % (
+                name, oper, base['median'], res['median'], ratio, status
+            ))
+            if status != 'ok':
+                regressions.append((name, oper, ratio))
+    return regressions
+
+
+def main():
+    '''
+    Main entry point.
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the ydiff module with synthetic manifests.')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per operation (default: 5)')
+    parser.add_argument('--filter', help='Only run cases matching this regex')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare with the results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown against the baseline (default: 0.25 = 25%%)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline = json.load(stream)
+
+    results = benchmark(args.repeat, args.filter)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        print('')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('\n%d regression(s) slower than %d%% of the baseline' % (len(regressions), args.tolerance * 100))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
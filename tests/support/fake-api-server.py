@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Fake Kubernetes API server for testing the ydiff module without a cluster.
+
+Started by 'fake-kubectl.sh proxy' in place of 'kubectl proxy': it serves on
+a random local port and announces it just like kubectl does:
+
+  Starting to serve on 127.0.0.1:<port>
+
+Serves API discovery of 'v1' (configmaps) and the ConfigMaps 'cm1' to 'cm4'
+(data.foo: bar) in every namespace, listed or by name. Requests accepting
+PartialObjectMetadata(List) only get the metadata of the objects, their
+resourceVersion is read from FAKE_KUBECTL_VERSION_FILE (defaults to 42).
+Every request is appended to the file FAKE_KUBECTL_LOG (if set) as
+'api <client port> GET <path>' (followed by 'metadata' for metadata-only
+requests), start and stop as 'api start' and 'api stop'. Set
+FAKE_KUBECTL_PROXY_OUTPUT to write that many bytes to stdout and stderr per
+request (like a verbose proxy, which must not block on its pipes).
+'''
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import re
+import sys
+import json
+import signal
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+LOG = os.environ.get('FAKE_KUBECTL_LOG')
+VERSION_FILE = os.environ.get('FAKE_KUBECTL_VERSION_FILE')
+OUTPUT = int(os.environ.get('FAKE_KUBECTL_PROXY_OUTPUT') or 0)
+
+DISCOVERY = {
+    '/api/v1': {
+        'kind': 'APIResourceList',
+        'groupVersion': 'v1',
+        'resources': [
+            {'name': 'configmaps', 'kind': 'ConfigMap', 'namespaced': True},
+            {'name': 'namespaces', 'kind': 'Namespace', 'namespaced': False},
+            {'name': 'namespaces/status', 'kind': 'Namespace', 'namespaced': False},
+        ],
+    },
+}
+
+
+def log(line):
+    '''
+    Append a line to the call log.
+    '''
+    if LOG:
+        with open(LOG, 'a') as stream:
+            stream.write(line + '\n')
+
+
+CONFIGMAPS = ('cm1', 'cm2', 'cm3', 'cm4')
+
+
+def version():
+    '''
+    Current resourceVersion of all objects.
+    '''
+    if VERSION_FILE and os.path.isfile(VERSION_FILE):
+        with open(VERSION_FILE) as stream:
+            return stream.read().strip()
+    return '42'
+
+
+def configmap(name, namespace, metadata=False):
+    '''
+    Deployed ConfigMap (without apiVersion and kind, as list items are returned).
+    '''
+    obj = {
+        'metadata': {
+            'name': name,
+            'namespace': namespace,
+            'resourceVersion': version(),
+            'uid': '00000000-0000-0000-0000-000000000000',
+        },
+    }
+    if not metadata:
+        obj['data'] = {'foo': 'bar'}
+    return obj
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    '''
+    Serve every (keep-alive) connection in its own thread.
+    '''
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Serve discovery and ConfigMap lists over keep-alive connections.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        '''
+        Handle a GET request.
+        '''
+        metadata = 'as=PartialObjectMetadata' in (self.headers.get('Accept') or '')
+        log('api %d GET %s%s' % (self.client_address[1], self.path, ' metadata' if metadata else ''))
+        if OUTPUT:
+            for stream in (sys.stdout, sys.stderr):
+                stream.write('.' * OUTPUT + '\n')
+                stream.flush()
+        match = re.match(r'^/api/v1/namespaces/([^/]+)/configmaps/?([^/]*)$', self.path)
+        if self.path in DISCOVERY:
+            self.reply(200, DISCOVERY[self.path])
+        elif match and not match.group(2):
+            items = [configmap(name, match.group(1), metadata) for name in CONFIGMAPS]
+            if metadata:
+                self.reply(200, {'kind': 'PartialObjectMetadataList', 'apiVersion': 'meta.k8s.io/v1', 'items': items})
+            else:
+                self.reply(200, {'kind': 'ConfigMapList', 'apiVersion': 'v1', 'items': items})
+        elif match and match.group(2) in CONFIGMAPS:
+            obj = configmap(match.group(2), match.group(1), metadata)
+            if metadata:
+                obj.update({'kind': 'PartialObjectMetadata', 'apiVersion': 'meta.k8s.io/v1'})
+            else:
+                obj.update({'kind': 'ConfigMap', 'apiVersion': 'v1'})
+            self.reply(200, obj)
+        else:
+            self.reply(404, {
+                'kind': 'Status',
+                'status': 'Failure',
+                'message': 'the server could not find the requested resource',
+                'code': 404,
+            })
+
+    def reply(self, code, obj):
+        '''
+        Send a JSON response.
+        '''
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+
+def stop(*_):
+    '''
+    Stop serving on SIGTERM.
+    '''
+    log('api stop')
+    sys.exit(0)
+
+
+def main():
+    '''
+    Main entry point.
+    '''
+    server = Server(('127.0.0.1', 0), Handler)
+    signal.signal(signal.SIGTERM, stop)
+    log('api start')
+    print('Starting to serve on 127.0.0.1:%d' % (server.server_address[1]))
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
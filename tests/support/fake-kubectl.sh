@@ -0,0 +1,169 @@
+#!/usr/bin/env bash
+#
+# Fake kubectl for testing the ydiff module without a cluster.
+#
+# Supports:
+#   fake-kubectl.sh [--context=<ctx>] get configmap <name> [-n <namespace>] -o yaml
+#   fake-kubectl.sh [--context=<ctx>] get configmap <name>... --ignore-not-found [-n <namespace>] -o yaml
+#   fake-kubectl.sh [--context=<ctx>] get configmap [-n <namespace>] -o yaml
+#   fake-kubectl.sh [--context=<ctx>] get configmap [-n <namespace>] -o name
+#   fake-kubectl.sh [--context=<ctx>] get configmap [<name>... --ignore-not-found] [-n <namespace>] \
+#     -o custom-columns=NAME:.metadata.name,VERSION:.metadata.resourceVersion --no-headers
+#   fake-kubectl.sh [--context=<ctx>] delete configmap <name> [-n <namespace>] [--ignore-not-found]
+#   fake-kubectl.sh [--context=<ctx>] config view --minify -o jsonpath={..namespace}
+#   fake-kubectl.sh [--context=<ctx>] proxy --port=0
+#
+# The cluster contains the ConfigMaps 'cm1' to 'cm4' (data.foo: bar) in every namespace.
+# The object named 'missing' does not exist and getting it fails (unless --ignore-not-found is given).
+# Set FAKE_KUBECTL_LATENCY to delay every call (in seconds) to simulate API round-trips.
+# Set FAKE_KUBECTL_LOG to a file to which every call is appended.
+# Set FAKE_KUBECTL_OBJECT to a yaml file to return it for any call (e.g.: 'get -f <file> -o yaml').
+# Set FAKE_KUBECTL_VERSION_FILE to a file containing the resourceVersion of all objects (defaults to 42).
+# The proxy is served by fake-api-server.py (same objects) and the context has no default namespace.
+#
+
+set -e
+set -u
+
+if [ -n "${FAKE_KUBECTL_LOG:-}" ]; then
+	echo "${*}" >> "${FAKE_KUBECTL_LOG}"
+fi
+
+case " ${*} " in
+	*" config view "*)
+		exit 0
+		;;
+	*" proxy "*)
+		exec python3 "$(dirname "${0}")/fake-api-server.py"
+		;;
+esac
+
+VERB=
+KIND=
+NAMES=()
+OUTPUT=
+IGNORE_NOT_FOUND=
+NAMESPACE=default
+while [ "${#}" -gt "0" ]; do
+	case "${1}" in
+		--context=*)
+			;;
+		-n|--namespace)
+			shift
+			NAMESPACE="${1}"
+			;;
+		-o)
+			shift
+			OUTPUT="${1}"
+			;;
+		--ignore-not-found)
+			IGNORE_NOT_FOUND=1
+			;;
+		get|delete)
+			VERB="${1}"
+			shift
+			KIND="${1}"
+			while [ "${#}" -gt "1" ] && [ "${2:0:1}" != "-" ]; do
+				shift
+				NAMES+=("${1}")
+			done
+			;;
+	esac
+	shift
+done
+
+sleep "${FAKE_KUBECTL_LATENCY:-0}"
+
+VERSION=42
+if [ -n "${FAKE_KUBECTL_VERSION_FILE:-}" ] && [ -f "${FAKE_KUBECTL_VERSION_FILE}" ]; then
+	VERSION="$(cat "${FAKE_KUBECTL_VERSION_FILE}")"
+fi
+
+if [ -n "${FAKE_KUBECTL_OBJECT:-}" ]; then
+	cat "${FAKE_KUBECTL_OBJECT}"
+	exit 0
+fi
+
+if [ "${KIND}" != "configmap" ]; then
+	>&2 echo "error: the server doesn't have a resource type \"${KIND}\""
+	exit 1
+fi
+
+configmap() {
+	local indent="${2:-}"
+	sed "s/^/${indent}/" <<YAML
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: ${1}
+  namespace: ${NAMESPACE}
+  resourceVersion: "${VERSION}"
+  uid: 00000000-0000-0000-0000-000000000000
+data:
+  foo: bar
+YAML
+}
+
+configmaps() {
+	echo "apiVersion: v1"
+	echo "kind: List"
+	if [ "${#}" -eq "0" ]; then
+		echo "items: []"
+		return
+	fi
+	echo "items:"
+	for name in "${@}"; do
+		configmap "${name}" "    " | sed '1s/^  /- /'
+	done
+}
+
+NAME="${NAMES[0]:-}"
+
+# Delete a single object (deletion is not persisted)
+if [ "${VERB}" = "delete" ]; then
+	if [ "${NAME}" != "missing" ]; then
+		echo "configmap \"${NAME}\" deleted"
+	fi
+	exit 0
+fi
+
+# Names and resourceVersions of all (or the found) objects
+if [ "${OUTPUT#custom-columns=}" != "${OUTPUT}" ]; then
+	if [ "${#NAMES[@]}" -eq "0" ]; then
+		NAMES=(cm1 cm2 cm3 cm4)
+	fi
+	for name in "${NAMES[@]}"; do
+		if [ "${name}" != "missing" ]; then
+			echo "${name}   ${VERSION}"
+		fi
+	done
+	exit 0
+fi
+
+# Get objects by name (a single object or a List of multiple objects)
+if [ -n "${NAME}" ]; then
+	FOUND=()
+	for name in "${NAMES[@]}"; do
+		if [ "${name}" != "missing" ]; then
+			FOUND+=("${name}")
+		elif [ -z "${IGNORE_NOT_FOUND}" ]; then
+			>&2 echo "Error from server (NotFound): configmaps \"${name}\" not found"
+			exit 1
+		fi
+	done
+	if [ "${#NAMES[@]}" -gt "1" ]; then
+		configmaps "${FOUND[@]}"
+	elif [ "${#FOUND[@]}" -gt "0" ]; then
+		configmap "${NAME}"
+	fi
+	exit 0
+fi
+
+# List all objects
+if [ "${OUTPUT}" = "name" ]; then
+	for name in cm1 cm2 cm3 cm4; do
+		echo "configmap/${name}"
+	done
+	exit 0
+fi
+configmaps cm1 cm2 cm3 cm4
@@ -2,6 +2,20 @@
 
 set -e
 ansible-playbook test_defaults.yml
+ansible-playbook test_filters.yml
+
+# the ydiff_profile callback also reports the timings of failed (ignored) diffs
+set -o pipefail
+ANSIBLE_CALLBACK_PLUGINS=../callback_plugins \
+ANSIBLE_CALLBACK_WHITELIST=timer,profile_tasks,ydiff_profile \
+ANSIBLE_CALLBACKS_ENABLED=timer,profile_tasks,ydiff_profile \
+	ansible-playbook test_ydiff.yml | tee /tmp/ydiff_run.log
+grep -q 'localhost: cm4 ' /tmp/ydiff_run.log
+if grep -q 'unexpected keyword' /tmp/ydiff_run.log; then
+	exit 1
+fi
+
+ansible-playbook test_remove.yml
 
 # running a second time to verify playbook's idempotence
 set +e